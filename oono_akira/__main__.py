@@ -1,13 +1,31 @@
 import asyncio
 import json
+import signal
 import sys
 
+from oono_akira import speedups
 from oono_akira.config import Configuration
+from oono_akira.log import log
 from oono_akira.oono import OonoAkira
+from oono_akira.shard import ShardFront
 
 
 async def amain(config: Configuration):
-    async with OonoAkira(config) as oono:
+    if "sharding" in config:
+        oono = ShardFront(config, config["sharding"]["workers"])
+    else:
+        oono = OonoAkira(config)
+    async with oono:
+        loop = asyncio.get_running_loop()
+
+        def stop():
+            # A second signal stops right away
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                loop.remove_signal_handler(signum)
+            oono.stop()
+
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop)
         await oono.run()
 
 
@@ -16,6 +34,11 @@ if __name__ == "__main__":
     with open(config_path) as f:
         config = json.load(f)
 
+    runtime = config.get("runtime", {})
+    loop = speedups.select_loop(runtime.get("loop", "auto"))
+    codec = speedups.select_json(runtime.get("json", "auto"))
+    log(f"Using event loop {loop}, JSON codec {codec}")
+
     try:
         asyncio.run(amain(config))
     except KeyboardInterrupt:
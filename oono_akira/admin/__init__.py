@@ -2,6 +2,7 @@ import os
 import re
 import importlib
 import shlex
+import threading
 from argparse import ArgumentParser, Namespace, Action
 from typing import Mapping, Callable, NoReturn, Awaitable, TypedDict, Literal
 
@@ -9,7 +10,6 @@ from oono_akira.slack.context import SlackContext
 from oono_akira.slack.block import Block
 from oono_akira.slack.send import SlackPayloadDumper
 
-
 CommandResponse = tuple[Literal["message"], str, list[Block]] | None
 Command = TypedDict(
     "Command",
@@ -21,6 +21,8 @@ Command = TypedDict(
 
 parser = None
 commands: Mapping[str, Command] = {}
+# The parser may be built in a background thread at startup while a command comes in
+parser_lock = threading.Lock()
 
 
 class OonoAdminException(Exception):
@@ -44,11 +46,15 @@ class OonoAdminArgumentParser(ArgumentParser):
 
 def get_parser():
     global parser, commands
-    if parser is None:
-        parser = OonoAdminArgumentParser(prog="/oono", add_help=False)
-        parser.register("action", "oono_help", OonoHelpAction)
-        parser.add_argument("-h", "--help", nargs=0, action="oono_help", help="Display help message")
-        subparsers = parser.add_subparsers(dest="command", metavar="<command>")
+    if parser is not None:
+        return parser
+    with parser_lock:
+        if parser is not None:
+            return parser
+        new_parser = OonoAdminArgumentParser(prog="/oono", add_help=False)
+        new_parser.register("action", "oono_help", OonoHelpAction)
+        new_parser.add_argument("-h", "--help", nargs=0, action="oono_help", help="Display help message")
+        subparsers = new_parser.add_subparsers(dest="command", metavar="<command>")
         for file in os.listdir(os.path.dirname(__file__)):
             if "__" in file:
                 continue
@@ -63,6 +69,7 @@ def get_parser():
             subparser.add_argument("-h", "--help", nargs=0, action="oono_help", help="Display help message")
             mod.setup(subparser)
             commands[mod_name] = {"parser": subparser, "handler": mod.handler}
+        parser = new_parser
     return parser
 
 
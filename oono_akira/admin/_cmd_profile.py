@@ -0,0 +1,166 @@
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import tracemalloc
+from argparse import ArgumentParser, Namespace
+from collections import Counter
+from datetime import datetime
+from types import FrameType
+
+from oono_akira.slack.context import SlackContext
+from oono_akira.slack.block import Block, RichTextElement, RichTextSpan
+from oono_akira.admin import CommandResponse
+
+PROFILE_DIR = os.environ.get("OONO_PROFILE_DIR", tempfile.gettempdir())
+MAX_SECONDS = 300
+SAMPLE_INTERVAL = 0.005
+
+running = False
+
+Stack = tuple[str, ...]
+
+
+def help():
+    return "Profile the running bot"
+
+
+def setup(parser: ArgumentParser):
+    parser.description = (
+        "Sample the event loop thread for CPU time, or trace memory allocations, for a while. "
+        "The top entries are sent back, and the full result is written to disk."
+    )
+    parser.add_argument("profile_type", metavar="<type>", choices=["cpu", "memory"], help="What to profile: cpu/memory")
+    parser.add_argument("--seconds", type=float, default=10, help="How long to profile for")
+    parser.add_argument("--top", type=int, default=15, help="Number of entries to reply with")
+
+
+def frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample_stacks(thread_id: int, stop: threading.Event, stacks: Counter[Stack]):
+    while not stop.wait(SAMPLE_INTERVAL):
+        frame = sys._current_frames().get(thread_id)
+        stack: list[str] = []
+        while frame is not None:
+            stack.append(frame_name(frame))
+            frame = frame.f_back
+        stacks[tuple(reversed(stack))] += 1
+
+
+def write_folded(path: str, stacks: Counter[Stack]):
+    # Collapsed stacks, the input format of flamegraph.pl and speedscope
+    with open(path, "w") as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{';'.join(stack)} {count}\n")
+
+
+async def profile_cpu(seconds: float, top: int) -> tuple[str, str]:
+    stacks: Counter[Stack] = Counter()
+    stop = threading.Event()
+    sampler = threading.Thread(
+        target=sample_stacks, args=(threading.get_ident(), stop, stacks), name="oono-profile", daemon=True
+    )
+    sampler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        stop.set()
+        await asyncio.to_thread(sampler.join)
+
+    path = os.path.join(PROFILE_DIR, f"oono-cpu-{datetime.now():%Y%m%d-%H%M%S}.folded")
+    await asyncio.get_running_loop().run_in_executor(None, write_folded, path, stacks)
+
+    total = sum(stacks.values())
+    idle = 0
+    own: Counter[str] = Counter()
+    cumulative: Counter[str] = Counter()
+    for stack, count in stacks.items():
+        # The loop waits for IO inside the selector, those samples are not CPU time
+        if not stack or "selectors.py" in stack[-1]:
+            idle += count
+            continue
+        own[stack[-1]] += count
+        # Every callback runs under the loop's frames, only count from the callback inwards
+        callbacks = [index for index, name in enumerate(stack) if name.startswith("_run (events.py")]
+        for name in set(stack[callbacks[-1] + 1 :] if callbacks else stack):
+            cumulative[name] += count
+    lines = [f"{total} samples in {seconds:g} s, {idle * 100 / max(total, 1):.1f}% idle", "", "Own:"]
+    for name, count in own.most_common(top):
+        lines.append(f"{count * 100 / total:6.1f}%  {name}")
+    lines += ["", "Cumulative:"]
+    for name, count in cumulative.most_common(top):
+        lines.append(f"{count * 100 / total:6.1f}%  {name}")
+    return path, "\n".join(lines)
+
+
+async def profile_memory(seconds: float, top: int) -> tuple[str, str]:
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start(25)
+    try:
+        before = tracemalloc.take_snapshot()
+        await asyncio.sleep(seconds)
+        after = tracemalloc.take_snapshot()
+    finally:
+        if started:
+            tracemalloc.stop()
+
+    path = os.path.join(PROFILE_DIR, f"oono-memory-{datetime.now():%Y%m%d-%H%M%S}.tracemalloc")
+    # Load with tracemalloc.Snapshot.load() for a full traceback of each allocation site
+    await asyncio.get_running_loop().run_in_executor(None, after.dump, path)
+
+    current = sum(stat.size for stat in after.statistics("filename"))
+    lines = [f"{current / 1024:.1f} KiB traced", "", "Allocated during profiling:"]
+    for stat in after.compare_to(before, "lineno")[:top]:
+        lines.append(f"{stat.size_diff / 1024:+10.1f} KiB {stat.count_diff:+7d}  {stat.traceback}")
+    lines += ["", "Largest:"]
+    for stat in after.statistics("lineno")[:top]:
+        lines.append(f"{stat.size / 1024:10.1f} KiB {stat.count:7d}  {stat.traceback}")
+    return path, "\n".join(lines)
+
+
+async def handler(context: SlackContext | None, args: Namespace) -> CommandResponse:
+    global running
+
+    # Profiling the command line process is pointless
+    if context is None:
+        return
+
+    command = context.must_command()
+    if command.user_id != context.workspace.adminId:
+        return "message", "No permission to profile", []
+    if not 0 < args.seconds <= MAX_SECONDS:
+        return "message", f"Profiling time must be between 0 and {MAX_SECONDS} seconds", []
+    if running:
+        return "message", "Another profile is running", []
+
+    running = True
+    try:
+        await context.api.chat.postEphemeral(
+            {**context.reply_args(), "text": f"Profiling {args.profile_type} for {args.seconds:g} seconds..."}
+        )
+        if args.profile_type == "cpu":
+            path, report = await profile_cpu(args.seconds, args.top)
+        else:
+            path, report = await profile_memory(args.seconds, args.top)
+    finally:
+        running = False
+
+    block = Block(
+        type="rich_text",
+        elements=[
+            RichTextElement(
+                type="rich_text_section",
+                elements=[
+                    RichTextSpan(type="text", text="Full profile written to "),
+                    RichTextSpan(type="text", text=path),
+                ],
+            ),
+            RichTextElement(type="rich_text_preformatted", elements=[RichTextSpan(type="text", text=report)]),
+        ],
+    )
+    return "message", f"Profiled {args.profile_type} for {args.seconds:g} seconds", [block]
@@ -0,0 +1,105 @@
+import asyncio
+import time
+from argparse import ArgumentParser, Namespace
+
+from oono_akira.slack.context import SlackContext
+from oono_akira.slack.block import Block, RichTextElement, RichTextSpan
+from oono_akira.admin import CommandResponse
+from oono_akira.metrics import (
+    ACK_LATENCY,
+    API_ERRORS,
+    BACKGROUND_TASKS,
+    CACHE_REQUESTS,
+    DEDUP_HITS,
+    DEDUP_TRACKER,
+    LOOP_BLOCKED,
+    LOOP_LAG,
+    QUEUE_DEPTH,
+)
+
+
+def help():
+    return "Show live runtime stats"
+
+
+def setup(parser: ArgumentParser):
+    parser.description = (
+        "Show queue depths, background tasks, dedup, caches, ack latency, Slack API errors and loop lag."
+    )
+
+
+async def measure_loop_lag() -> float:
+    # Time for a callback to get its turn, which is how long everything queued before it takes
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    start = time.perf_counter()
+    loop.call_soon(future.set_result, None)
+    await future
+    return time.perf_counter() - start
+
+
+def collect(lag: float) -> str:
+    # Only reads counters that are already kept, so it's cheap to run under load
+    lines: list[str] = []
+
+    queues = QUEUE_DEPTH.collect()
+    lines.append(f"Executor queues: {len(queues)} active, {sum(queues.values()):g} waiting")
+    for (name,), depth in sorted(queues.items(), key=lambda item: -item[1]):
+        lines.append(f"  {name}: {depth:g}")
+
+    tasks = BACKGROUND_TASKS.collect()
+    lines.append("Background tasks: " + ", ".join(f"{owner} {count:g}" for (owner,), count in sorted(tasks.items())))
+
+    tracker = DEDUP_TRACKER.collect()
+    hits = DEDUP_HITS.values.get((), 0)
+    lines.append(
+        f"Dedup tracker: {tracker.get(('done',), 0):g} done, {tracker.get(('inflight',), 0):g} in flight, "
+        f"{tracker.get(('elsewhere',), 0):g} elsewhere, {hits:g} hits"
+    )
+
+    caches: dict[str, dict[str, float]] = {}
+    for (cache, result), count in CACHE_REQUESTS.values.items():
+        caches.setdefault(cache, {})[result] = count
+    lines.append("Caches:" if caches else "Caches: none used yet")
+    for cache, results in sorted(caches.items()):
+        total = results.get("hit", 0) + results.get("miss", 0)
+        lines.append(f"  {cache}: {results.get('hit', 0) * 100 / total:.1f}% hit of {total:g}")
+
+    p50, p90, p99, p100 = ACK_LATENCY.percentiles([0.5, 0.9, 0.99, 1.0])
+    lines.append(
+        f"Ack latency, last {len(ACK_LATENCY.recent.get((), ()))}:"
+        f" p50 {p50 * 1000:.1f} ms, p90 {p90 * 1000:.1f} ms, p99 {p99 * 1000:.1f} ms, max {p100 * 1000:.1f} ms"
+    )
+
+    lines.append(f"Slack API errors: {sum(API_ERRORS.values.values()):g}")
+    for (method, error), count in sorted(API_ERRORS.values.items(), key=lambda item: -item[1]):
+        lines.append(f"  {method} {error}: {count:g}")
+
+    p50, p99, p100 = LOOP_LAG.percentiles([0.5, 0.99, 1.0])
+    lines.append(
+        f"Loop lag: now {lag * 1000:.2f} ms,"
+        f" p50 {p50 * 1000:.1f} ms, p99 {p99 * 1000:.1f} ms, max {p100 * 1000:.1f} ms"
+    )
+    for (module,), (_, total) in sorted(LOOP_BLOCKED.values.items(), key=lambda item: -item[1][1][0]):
+        lines.append(f"  blocked by {module}: {int(total[1])} times, {total[0] * 1000:.0f} ms")
+    return "\n".join(lines)
+
+
+async def handler(context: SlackContext | None, args: Namespace) -> CommandResponse:
+    if context is None:
+        return "message", collect(await measure_loop_lag()), []
+
+    command = context.must_command()
+    if command.user_id != context.workspace.adminId:
+        return "message", "No permission to show stats", []
+
+    block = Block(
+        type="rich_text",
+        elements=[
+            RichTextElement(
+                type="rich_text_preformatted",
+                elements=[RichTextSpan(type="text", text=collect(await measure_loop_lag()))],
+            ),
+        ],
+    )
+    return "message", "Runtime stats", [block]
@@ -0,0 +1,111 @@
+import asyncio
+import gzip
+import json
+import os
+import random
+import traceback
+from argparse import ArgumentParser
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Mapping, Sequence
+
+from oono_akira import speedups
+from oono_akira.config import ArchiveConfiguration, Configuration
+from oono_akira.db import OonoDatabase
+from oono_akira.log import log
+
+
+def payload_kind(frame: Any) -> str:
+    # Like "slash_commands" or "events_api/message", sample rates are looked up by the kind, then by the type
+    if frame.get("type") == "events_api":
+        return f"events_api/{frame['payload']['event']['type']}"
+    return frame.get("type", "unknown")
+
+
+def write_partitions(partitions: Mapping[str, Sequence[str]]):
+    for path, lines in partitions.items():
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Every batch is a gzip member of its own, readers see one stream
+        with open(path, "ab") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="ab") as f:
+                f.write(("\n".join(lines) + "\n").encode())
+            raw.flush()
+            os.fsync(raw.fileno())
+
+
+class PayloadArchive:
+    """Samples recorded payloads by kind, and moves rows past retention into compressed files, one per day."""
+
+    DEFAULT_RETENTION = 7 * 86400
+    DEFAULT_INTERVAL = 3600
+    BATCH = 1000
+
+    def __init__(self, config: ArchiveConfiguration, db: OonoDatabase):
+        self._path = config["path"]
+        self._retention = config.get("retention", self.DEFAULT_RETENTION)
+        self._interval = config.get("interval", self.DEFAULT_INTERVAL)
+        self._sample = config.get("sample", {})
+        self._db = db
+        self._task: asyncio.Task[None] | None = None
+
+    async def __aenter__(self):
+        # With several instances on one database, only one of them should compact
+        if self._interval > 0:
+            self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, *_):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def sampled(self, frame: Any) -> bool:
+        kind = payload_kind(frame)
+        rate = self._sample.get(kind, self._sample.get(kind.partition("/")[0], 1.0))
+        return rate >= 1 or random.random() < rate
+
+    async def compact(self, now: datetime | None = None) -> int:
+        before = (now or datetime.now(timezone.utc)) - timedelta(seconds=self._retention)
+        total = 0
+        while payloads := await self._db.get_payloads_before(before, self.BATCH):
+            partitions: defaultdict[str, list[str]] = defaultdict(list)
+            for payload in payloads:
+                path = os.path.join(self._path, payload.source, f"{payload.createdAt:%Y-%m-%d}.jsonl.gz")
+                line = {"created_at": payload.createdAt.isoformat(), "content": payload.content}
+                partitions[path].append(speedups.dumps(line))
+            # Rows are only deleted once they are on disk, a crash in between archives them twice at worst
+            await asyncio.get_running_loop().run_in_executor(None, write_partitions, partitions)
+            await self._db.delete_payloads([payload.id for payload in payloads])
+            total += len(payloads)
+        if total:
+            log(f"Archived {total} payloads older than {before.isoformat()}", category="archive")
+        return total
+
+    async def _run(self):
+        while True:
+            try:
+                await self.compact()
+            except Exception:
+                log("Payload compaction failed", level="error", traceback=traceback.format_exc())
+            await asyncio.sleep(self._interval)
+
+
+async def compact(config: Configuration):
+    async with OonoDatabase(config["database"]) as db:
+        count = await PayloadArchive(config["archive"], db).compact()
+    print(f"Archived {count} payloads to {config['archive']['path']}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        prog="python -m oono_akira.archive",
+        description="Move recorded payloads past retention into the archive once, and exit. "
+        "Archive files can be replayed with python -m oono_akira.replay --file.",
+    )
+    parser.add_argument("config", help="Path to the configuration file")
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        config = json.load(f)
+
+    asyncio.run(compact(config))
@@ -0,0 +1,149 @@
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from typing import Any
+
+from aiohttp import WSMsgType, web
+from aiohttp.web_request import Request
+
+from oono_akira.log import log
+
+
+class FakeSlack:
+    """A local stand-in for Socket Mode and the Web API methods the modules call."""
+
+    def __init__(self, latency: float = 0, rate_limit: float = 0, seed: int = 0):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self._random = random.Random(seed)
+        self._app = web.Application()
+        self._app.add_routes(
+            [
+                web.post("/api/apps.connections.open", self._connections_open),
+                web.get("/socket", self._socket),
+                web.route("*", "/api/{method}", self._web_api),
+            ]
+        )
+        self._socket_conn: web.WebSocketResponse | None = None
+        self._sequence = 0
+        self.connected = asyncio.Event()
+        # Envelope ID to send time, and to ack time
+        self.sent: dict[str, float] = {}
+        self.acked: dict[str, float] = {}
+        self.ack_errors = 0
+        # Channel to the time of the first reply posted there
+        self.replies: dict[str, float] = {}
+        self.calls: Counter[str] = Counter()
+        self.rate_limited = 0
+
+    async def __aenter__(self):
+        self._runner = web.AppRunner(self._app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}"
+        log(f"Fake Slack listening on {self.url}")
+        return self
+
+    async def __aexit__(self, *_):
+        if self._socket_conn is not None:
+            await self._socket_conn.close()
+        await self._runner.cleanup()
+
+    @property
+    def api_url(self):
+        return f"{self.url}/api"
+
+    async def send_event(self, team_id: str, channel: str, user: str, text: str) -> str:
+        return await self._send(
+            "events_api",
+            {
+                "type": "event_callback",
+                "team_id": team_id,
+                "event_id": f"Ev{self._sequence + 1:08d}",
+                "event": {
+                    "type": "message",
+                    "user": user,
+                    "channel": channel,
+                    "ts": f"{time.time():.6f}",
+                    "text": text,
+                },
+            },
+        )
+
+    async def send_command(self, team_id: str, channel: str, user: str, command: str, text: str) -> str:
+        return await self._send(
+            "slash_commands",
+            {
+                "team_id": team_id,
+                "channel_id": channel,
+                "user_id": user,
+                "command": command,
+                "text": text,
+                "response_url": f"{self.url}/response",
+            },
+        )
+
+    async def disconnect(self, reason: str = "warning"):
+        if self._socket_conn is not None:
+            self.connected.clear()
+            await self._socket_conn.send_json({"type": "disconnect", "reason": reason})
+
+    async def _send(self, type: str, payload: Any) -> str:
+        if self._socket_conn is None:
+            raise RuntimeError("no socket mode connection")
+        self._sequence += 1
+        envelope_id = f"envelope-{self._sequence:08d}"
+        self.sent[envelope_id] = time.perf_counter()
+        await self._socket_conn.send_json({"type": type, "envelope_id": envelope_id, "payload": payload})
+        return envelope_id
+
+    async def _connections_open(self, _: Request):
+        self.calls["apps.connections.open"] += 1
+        return web.json_response({"ok": True, "url": f"{self.url.replace('http', 'ws', 1)}/socket"})
+
+    async def _socket(self, request: Request):
+        conn = web.WebSocketResponse()
+        await conn.prepare(request)
+        self._socket_conn = conn
+        await conn.send_json({"type": "hello", "num_connections": 1, "connection_info": {"app_id": "AFAKE"}})
+        self.connected.set()
+        async for msg in conn:
+            if msg.type != WSMsgType.TEXT:
+                continue
+            envelope_id = json.loads(msg.data).get("envelope_id")
+            # Slack ignores acks of unknown envelopes, but for us they're bugs
+            if envelope_id not in self.sent or envelope_id in self.acked:
+                self.ack_errors += 1
+                continue
+            self.acked[envelope_id] = time.perf_counter()
+        if self._socket_conn is conn:
+            self._socket_conn = None
+            self.connected.clear()
+        return conn
+
+    async def _web_api(self, request: Request):
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.rate_limit and self._random.random() < self.rate_limit:
+            self.rate_limited += 1
+            return web.json_response({"ok": False, "error": "ratelimited"}, status=429, headers={"Retry-After": "1"})
+        if request.content_type == "application/json":
+            body = await request.json()
+        else:
+            body = {**request.query, **(await request.post())}
+        if method in ("chat.postMessage", "chat.postEphemeral"):
+            self.replies.setdefault(body.get("channel", ""), time.perf_counter())
+            return web.json_response({"ok": True, "channel": body.get("channel"), "ts": f"{time.time():.6f}"})
+        if method == "reactions.add":
+            return web.json_response({"ok": True})
+        if method == "users.info":
+            return web.json_response(
+                {"ok": True, "user": {"id": body.get("user"), "profile": {"display_name": "fake"}}}
+            )
+        return web.json_response({"ok": False, "error": "unknown_method"})
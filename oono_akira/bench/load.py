@@ -0,0 +1,122 @@
+import asyncio
+import json
+import random
+import time
+from argparse import ArgumentParser
+from typing import Any
+
+from oono_akira import speedups
+from oono_akira.bench.fake_slack import FakeSlack
+from oono_akira.config import Configuration
+from oono_akira.db import OonoDatabase
+from oono_akira.oono import OonoAkira
+from oono_akira.replay import percentile
+
+TEAM_ID = "TLOADTEST"
+BOT_ID = "BLOADTEST"
+USER_ID = "ULOADTEST"
+# Half of them get a reply from paren, the rest are dropped by every constructor
+TEXTS = ["早上好", "lgtm", "(这个不太对", "我觉得可以「试一下", "deployed to prod", "【通知】今晚发版"]
+
+
+async def seed(config: Configuration):
+    async with OonoDatabase(config["database"]) as db:
+        await db.setup_workspace(TEAM_ID, "Load Test", BOT_ID, USER_ID, "xoxb-load-test", "")
+        await db.grant_access(TEAM_ID, "", "", "paren")
+
+
+async def run(config: Configuration, count: int, rate: float, latency: float, rate_limit: float, drain: float):
+    await seed(config)
+    async with FakeSlack(latency=latency, rate_limit=rate_limit) as slack:
+        # The payload archive, snapshot and shared dedup store are left to the instance that owns them
+        config = {
+            **{key: value for key, value in config.items() if key not in ("archive", "snapshot")},  # type: ignore
+            "slack": {**config["slack"], "api_url": slack.api_url},
+            "server": {"port": 0},
+        }
+        if "dedup" in config:
+            config["dedup"] = {key: value for key, value in config["dedup"].items() if key != "path"}
+        async with OonoAkira(config) as oono:
+            runner = asyncio.create_task(oono.run())
+            await asyncio.wait_for(slack.connected.wait(), 10)
+            rng = random.Random(0)
+            start = time.perf_counter()
+            for index in range(count):
+                delay = start + index / rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await slack.send_event(TEAM_ID, f"C{index:08d}", USER_ID, rng.choice(TEXTS))
+            sent = time.perf_counter() - start
+            # Wait for the acks, then for the replies to stop coming
+            deadline = time.perf_counter() + drain
+            replies = -1
+            while time.perf_counter() < deadline and (len(slack.acked) < count or len(slack.replies) != replies):
+                replies = len(slack.replies)
+                await asyncio.sleep(0.5)
+            runner.cancel()
+
+    channels = {f"C{index:08d}": envelope for index, envelope in enumerate(slack.sent)}
+    ack_latency = [slack.acked[envelope] - slack.sent[envelope] for envelope in slack.sent if envelope in slack.acked]
+    reply_latency = [
+        slack.replies[channel] - slack.sent[envelope]
+        for channel, envelope in channels.items()
+        if channel in slack.replies
+    ]
+    return {
+        "loop": type(asyncio.get_running_loop()).__module__,
+        "json": speedups.json_name,
+        "events": count,
+        "target_rate": rate,
+        "send_rate": count / sent if sent else 0.0,
+        "ack_rate": len(ack_latency) / (max(slack.acked.values()) - start) if slack.acked else 0.0,
+        "acked": len(ack_latency),
+        "unacked": count - len(ack_latency),
+        "ack_errors": slack.ack_errors,
+        "replies": len(reply_latency),
+        "rate_limited": slack.rate_limited,
+        "ack_latency": {f"p{int(p * 100)}": percentile(ack_latency, p) for p in (0.5, 0.9, 0.99, 1.0)},
+        "reply_latency": {f"p{int(p * 100)}": percentile(reply_latency, p) for p in (0.5, 0.9, 0.99, 1.0)},
+        "api_calls": dict(slack.calls),
+    }
+
+
+def print_report(report: dict[str, Any]):
+    print(f"Event loop {report['loop']}, JSON codec {report['json']}")
+    print(
+        f"Sent {report['events']} events at {report['send_rate']:.1f}/s (target {report['target_rate']:.1f}/s),"
+        f" acked {report['acked']} at {report['ack_rate']:.1f}/s, {report['unacked']} unacked,"
+        f" {report['ack_errors']} bad acks"
+    )
+    print(f"Replies: {report['replies']}, rate limited API calls: {report['rate_limited']}")
+    print("Envelope to ack: " + ", ".join(f"{k} {v * 1000:.2f} ms" for k, v in report["ack_latency"].items()))
+    print("Envelope to reply: " + ", ".join(f"{k} {v * 1000:.2f} ms" for k, v in report["reply_latency"].items()))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        prog="python -m oono_akira.bench.load",
+        description="Drive a real OonoAkira instance with events from a local fake Slack. "
+        "A load test workspace is written to the configured database, so point it at a scratch copy.",
+    )
+    parser.add_argument("config", help="Path to the configuration file")
+    parser.add_argument("--count", type=int, default=10000, help="Number of events to send")
+    parser.add_argument("--rate", type=float, default=1000, help="Events sent per second")
+    parser.add_argument("--latency", type=float, default=0, help="Seconds every fake Web API call takes")
+    parser.add_argument("--rate-limit", type=float, default=0, help="Fraction of Web API calls answered with 429")
+    parser.add_argument("--drain", type=float, default=30, help="Seconds to wait for outstanding acks")
+    parser.add_argument("--output", metavar="FILE", help="Also write the report to a JSON file")
+    parser.add_argument("--loop", default="auto", help="Event loop to run: auto/uvloop/asyncio")
+    parser.add_argument("--json", default="auto", help="JSON codec to use: auto/orjson/json")
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        config = json.load(f)
+
+    speedups.select_loop(args.loop)
+    speedups.select_json(args.json)
+
+    result = asyncio.run(run(config, args.count, args.rate, args.latency, args.rate_limit, args.drain))
+    print_report(result)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
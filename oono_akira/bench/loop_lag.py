@@ -0,0 +1,115 @@
+import asyncio
+import json
+import random
+import sys
+import time
+from typing import Any, Awaitable, Callable
+
+from aiohttp import ClientSession, web
+
+from oono_akira.lunar import get_lunar_year
+from oono_akira.modules import ModulesManager
+from oono_akira.modules._03_idiom import build_dict_data
+
+TICK = 0.001
+# Loading through a module must lag the loop less than this share of building inline. Off the loop the idiom
+# build still lags it by about a third, through the GIL, one moved back onto the loop at least as much as inline.
+LAG_RATIO = 0.75
+SYLLABLES = ["yī", "wàn", "zhòng", "lǜ", "chū", "xióng", "guǎng", "ài", "shān", "nǚ", "qīng", "dìng"]
+
+
+def make_idiom_data(count: int) -> str:
+    rng = random.Random(0)
+    items: list[Any] = []
+    for index in range(count):
+        items.append(
+            {
+                "word": f"成语{index:05d}",
+                "pinyin": " ".join(rng.choice(SYLLABLES) for _ in range(4)),
+                "explanation": "释义" * 20,
+            }
+        )
+    return json.dumps(items, ensure_ascii=False)
+
+
+async def measure(name: str, job: Callable[[], Awaitable[Any]]) -> float:
+    lags: list[float] = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(TICK)
+            lags.append(time.perf_counter() - start - TICK)
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(TICK * 10)
+    start = time.perf_counter()
+    await job()
+    elapsed = time.perf_counter() - start
+    done.set()
+    await task
+    lags.sort()
+    p99 = lags[int(len(lags) * 0.99)] if lags else elapsed
+    worst = lags[-1] if lags else elapsed
+    print(f"{name:<24} took {elapsed * 1000:8.1f} ms, loop lag p99 {p99 * 1000:6.1f} ms, max {worst * 1000:6.1f} ms")
+    return p99
+
+
+async def main():
+    text = make_idiom_data(30000)
+    years = list(range(2000, 2040))
+
+    async def serve_idiom_data(_: web.Request):
+        return web.Response(text=text, content_type="application/json")
+
+    async def build_inline():
+        build_dict_data(text)
+
+    async def lunar_inline():
+        for year in years:
+            get_lunar_year(year)
+
+    app = web.Application()
+    app.add_routes([web.get("/idiom.json", serve_idiom_data)])
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    try:
+        async with ClientSession() as session, ModulesManager(session) as modules:
+            # The loaders the modules really use, so that one moved back onto the loop fails here
+            idiom = modules.module("idiom")
+            idiom.dict_data_url = f"http://127.0.0.1:{port}/idiom.json"
+            moyu = modules.module("moyu")
+
+            async def build_module():
+                await idiom.load_dict_data()
+
+            async def lunar_module():
+                for year in years:
+                    await moyu.load_chinese_calendar(year)
+
+            async def build_process():
+                await modules.run_in_executor(build_dict_data, text, process=True)
+
+            results = [
+                ("idiom", await measure("idiom inline", build_inline), await measure("idiom module", build_module)),
+                ("lunar", await measure("lunar inline", lunar_inline), await measure("lunar module", lunar_module)),
+            ]
+            # Includes spawning the worker processes, which blocks the loop once
+            await measure("idiom process pool", build_process)
+    finally:
+        await runner.cleanup()
+
+    failed = False
+    for name, inline, module in results:
+        if module > inline * LAG_RATIO:
+            print(f"Loading {name} through its module lags the loop like building it inline does")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,94 @@
+import gc
+import json
+import sys
+import tracemalloc
+from argparse import ArgumentParser
+from typing import Any, cast
+
+from oono_akira import speedups
+from oono_akira.bench.micro import MESSAGE_FRAME, RICH_TEXT_BLOCKS
+from oono_akira.slack.context import SlackContext
+from oono_akira.slack.recv import SlackEventsApiPayload, SlackPayloadParser
+from oono_akira.trace import Trace
+
+
+def make_frames(count: int, rich_text: bool) -> list[str]:
+    # Distinct frames, so that no string is shared between events the way it would be in a benchmark loop
+    frame = json.loads(json.dumps(MESSAGE_FRAME))
+    if rich_text:
+        frame["payload"]["event"]["blocks"] = RICH_TEXT_BLOCKS
+    frames: list[str] = []
+    for index in range(count):
+        frame["envelope_id"] = f"envelope-{index:08d}"
+        frame["payload"]["event_id"] = f"Ev{index:08d}"
+        frame["payload"]["event"]["ts"] = frame["payload"]["event"]["event_ts"] = f"1700000000.{index:06d}"
+        frames.append(json.dumps(frame, ensure_ascii=False))
+    return frames
+
+
+def hold(data: str) -> tuple[SlackContext, SlackEventsApiPayload]:
+    # What the pipeline keeps of a queued event: its context, and the payload the ack closure refers to
+    frame = SlackPayloadParser.parse(speedups.loads(data))
+    assert frame.envelope_id is not None
+    payload = cast(SlackEventsApiPayload, frame.payload)
+    context = SlackContext(
+        id=frame.envelope_id,
+        api=cast(Any, None),
+        db=cast(Any, None),
+        ack=cast(Any, None),
+        workspace=cast(Any, None),
+        event=payload.event,
+        trace=Trace(None, 0.0),
+    )
+    return context, payload
+
+
+def shallow_size(value: Any, seen: set[int]) -> int:
+    # Size of the model objects themselves, with their __dict__ if they have one, but not the strings they hold
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(shallow_size(item, seen) for item in value)  # type: ignore
+    if not hasattr(value, "__dataclass_fields__") and not isinstance(value, Trace):
+        return 0
+    size = sys.getsizeof(value)
+    if hasattr(value, "__dict__"):
+        size += sys.getsizeof(value.__dict__)
+    for name in getattr(value, "__dataclass_fields__", ()):
+        size += shallow_size(getattr(value, name), seen)
+    return size
+
+
+def measure(count: int, rich_text: bool) -> dict[str, float]:
+    frames = make_frames(count, rich_text)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    held = [hold(data) for data in frames]
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    seen: set[int] = set()
+    models = sum(shallow_size(context, seen) + shallow_size(payload, seen) for context, payload in held)
+    return {
+        "total": (after - before) / count,
+        "models": models / count,
+    }
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        prog="python -m oono_akira.bench.memory",
+        description="Bytes kept per queued event, parsed from distinct frames and held like the dispatch pipeline does",
+    )
+    parser.add_argument("--events", type=int, default=2000, help="Number of events held at once")
+    args = parser.parse_args()
+
+    for rich_text in (False, True):
+        result = measure(args.events, rich_text)
+        print(
+            f"{'message with rich text' if rich_text else 'plain message':<24}"
+            f" {result['total']:8.0f} bytes/event,"
+            f" of which {result['models']:6.0f} in model objects"
+        )
@@ -0,0 +1,357 @@
+import asyncio
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Awaitable, Callable, cast
+
+from aiohttp import ClientSession
+
+from oono_akira import speedups
+from oono_akira.db import OonoDatabase
+from oono_akira.db.prisma.models import Workspace
+from oono_akira.dedup import DedupStore
+from oono_akira.modules import ModulesManager
+from oono_akira.modules._02_paren import handler as paren_handler
+from oono_akira.slack.block import Block, RichTextElement, RichTextSpan, RichTextStyle
+from oono_akira.slack.context import SlackContext
+from oono_akira.slack.recv import SlackEventPayload, SlackPayloadParser
+from oono_akira.slack.send import SlackAPI, SlackPayloadDumper
+
+SAMPLE_TIME = 0.05
+REPEAT = 7
+
+TEAM_ID = "TBENCH"
+BOT_ID = "BBENCH"
+USER_ID = "UBENCH"
+CHANNEL_ID = "CBENCH"
+
+MESSAGE_EVENT = {
+    "type": "message",
+    "user": USER_ID,
+    "channel": CHANNEL_ID,
+    "ts": "1700000000.000100",
+    "client_msg_id": "5f0a3e4c-2b1d-4c6e-8f7a-9b0c1d2e3f40",
+    "text": "今天中午吃什么 (有人一起吗",
+    "team": TEAM_ID,
+    "channel_type": "channel",
+    "event_ts": "1700000000.000100",
+}
+MESSAGE_FRAME = {
+    "envelope_id": "0b2b4f3a-7d5e-4e4b-9a53-3c1f2f0a9d11",
+    "type": "events_api",
+    "accepts_response_payload": False,
+    "retry_attempt": 0,
+    "retry_reason": "",
+    "payload": {
+        "token": "XXYYZZ",
+        "team_id": TEAM_ID,
+        "api_app_id": "ABENCH",
+        "type": "event_callback",
+        "event_id": "Ev0BENCH",
+        "event_time": 1700000000,
+        "event": MESSAGE_EVENT,
+    },
+}
+RICH_TEXT_BLOCKS = [
+    {
+        "type": "rich_text",
+        "block_id": "aBc1",
+        "elements": [
+            {
+                "type": "rich_text_section",
+                "elements": [
+                    {"type": "text", "text": "今天中午吃什么 "},
+                    {"type": "text", "text": "有人一起吗", "style": {"bold": True}},
+                    {"type": "emoji", "name": "rice", "unicode": "1f35a"},
+                ],
+            },
+            {
+                "type": "rich_text_list",
+                "style": "bullet",
+                "indent": 0,
+                "elements": [
+                    {"type": "rich_text_section", "elements": [{"type": "text", "text": "拉面"}]},
+                    {
+                        "type": "rich_text_section",
+                        "elements": [{"type": "text", "text": "盖饭", "style": {"strike": True}}],
+                    },
+                ],
+            },
+        ],
+    }
+]
+
+
+@dataclass
+class BenchState:
+    session: ClientSession
+    modules: ModulesManager
+    db: OonoDatabase | None
+
+
+Benchmark = Callable[[], Any]
+BenchmarkSetup = Callable[[BenchState], Awaitable[Benchmark | None]]
+BENCHMARKS: dict[str, BenchmarkSetup] = {}
+
+
+def benchmark(name: str) -> Callable[[BenchmarkSetup], BenchmarkSetup]:
+    def _register(func: BenchmarkSetup):
+        BENCHMARKS[name] = func
+        return func
+
+    return _register
+
+
+def make_context(state: BenchState, text: str) -> SlackContext:
+    now = datetime.now()
+    return SlackContext(
+        id="bench",
+        api=SlackAPI(state.session),
+        db=cast(OonoDatabase, state.db),
+        ack=cast(Any, None),
+        workspace=Workspace(
+            id=TEAM_ID, name="Bench", botId=BOT_ID, adminId=USER_ID, hookUrl="", token="", createdAt=now, updatedAt=now
+        ),
+        event=SlackPayloadParser._parse(SlackEventPayload, {**MESSAGE_EVENT, "text": text}),  # type: ignore
+    )
+
+
+@benchmark("parse.message")
+async def bench_parse_message(_: BenchState):
+    return lambda: SlackPayloadParser.parse(MESSAGE_FRAME)
+
+
+@benchmark("parse.message_rich_text")
+async def bench_parse_message_rich_text(_: BenchState):
+    frame = json.loads(json.dumps(MESSAGE_FRAME))
+    frame["payload"]["event"]["blocks"] = RICH_TEXT_BLOCKS
+    return lambda: SlackPayloadParser.parse(frame)
+
+
+def make_block() -> Block:
+    return Block(
+        type="rich_text",
+        elements=[
+            RichTextElement(
+                type="rich_text_section",
+                elements=[
+                    RichTextSpan(type="text", text="Hello from Oono Akira!\n"),
+                    RichTextSpan(type="text", text="bold", style=RichTextStyle(bold=True)),
+                ],
+            ),
+            RichTextElement(
+                type="rich_text_list",
+                style="bullet",
+                elements=[
+                    RichTextElement(type="rich_text_section", elements=[RichTextSpan(type="text", text=str(index))])
+                    for index in range(5)
+                ],
+            ),
+        ],
+    )
+
+
+@benchmark("dump.blocks")
+async def bench_dump_blocks(_: BenchState):
+    block = make_block()
+    return lambda: SlackPayloadDumper.dump(block)
+
+
+def register_codec(name: str):
+    codec_loads, codec_dumps = speedups.CODECS[name]
+
+    @benchmark(f"codec.{name}.loads_frame")
+    async def bench_loads_frame(_: BenchState):
+        frame = json.loads(json.dumps(MESSAGE_FRAME))
+        frame["payload"]["event"]["blocks"] = RICH_TEXT_BLOCKS
+        data = json.dumps(frame)
+        return lambda: codec_loads(data)
+
+    @benchmark(f"codec.{name}.dumps_message")
+    async def bench_dumps_message(_: BenchState):
+        body = {"channel": CHANNEL_ID, "text": "Hello", "blocks": [SlackPayloadDumper.dump(make_block())]}
+        return lambda: codec_dumps(body)
+
+
+for codec_name in speedups.CODECS:
+    register_codec(codec_name)
+
+
+@benchmark("dedup.claim_finish")
+async def bench_dedup(_: BenchState):
+    # The in-memory front, which is all a claim costs when no shared store is configured
+    store = DedupStore()
+    now = time.time()
+    for index in range(10000):
+        store._claim_local(f"Ev{index:08d}", "prefill", now)
+    counter = iter(range(sys.maxsize))
+
+    def run():
+        event_id = f"Evnew{next(counter)}"
+        store._claim_local(event_id, "unknown", time.time())
+        store.update(event_id, "handler")
+        store.finish(event_id)
+
+    return run
+
+
+@benchmark("dispatch.message_constructors")
+async def bench_message_constructors(state: BenchState):
+    rng = random.Random(0)
+    texts = ["早上好", "lgtm", "(这个不太对", f"<@{BOT_ID}>", "deployed to prod", "~不会~"]
+    contexts = [make_context(state, rng.choice(texts)) for _ in range(64)]
+    counter = iter(range(sys.maxsize))
+
+    def run():
+        context = contexts[next(counter) % len(contexts)]
+        for _, constructor in state.modules.iterate_modules("message"):
+            if constructor(context, {"is_locked": False, "has_access": True}) is not None:
+                break
+
+    return run
+
+
+@benchmark("paren.long_text")
+async def bench_paren_long_text(state: BenchState):
+    line = "2024-01-01T00:00:00Z INFO request handled path=/api/v1/users status=200 (took 12ms) [worker-3]\n"
+    context = make_context(state, line * 1000 + "(")
+    return lambda: paren_handler(context, {"is_locked": False, "has_access": True})
+
+
+@benchmark("db.get_accesses")
+async def bench_get_accesses(state: BenchState):
+    db = state.db
+    if db is None:
+        return None
+    return lambda: db.get_accesses(TEAM_ID, CHANNEL_ID, USER_ID)
+
+
+@benchmark("db.get_locks")
+async def bench_get_locks(state: BenchState):
+    db = state.db
+    if db is None:
+        return None
+    return lambda: db.get_locks(TEAM_ID, CHANNEL_ID)
+
+
+async def seed(db: OonoDatabase):
+    rng = random.Random(0)
+    await db.setup_workspace(TEAM_ID, "Bench", BOT_ID, USER_ID, "", "")
+    await db.grant_access(TEAM_ID, "", "", "moyu")
+    await db.grant_access(TEAM_ID, CHANNEL_ID, "", "paren")
+    await db.grant_access(TEAM_ID, "", USER_ID, "strike")
+    for index in range(500):
+        channel = f"C{rng.randrange(100):04d}" if rng.random() < 0.5 else ""
+        user = f"U{rng.randrange(1000):04d}" if rng.random() < 0.5 else ""
+        await db.grant_access(TEAM_ID, channel, user, f"module{index % 10}")
+    for index in range(100):
+        await db.acquire_lock(TEAM_ID, f"C{index:04d}", "idiom")
+
+
+async def measure(func: Benchmark) -> dict[str, Any]:
+    is_async = asyncio.iscoroutine(result := func())
+    if is_async:
+        await result
+
+    async def timed(loops: int) -> float:
+        start = time.perf_counter()
+        if is_async:
+            for _ in range(loops):
+                await func()
+        else:
+            for _ in range(loops):
+                func()
+        return time.perf_counter() - start
+
+    loops = 1
+    while (elapsed := await timed(loops)) < SAMPLE_TIME:
+        loops = max(loops * 2, int(loops * SAMPLE_TIME / max(elapsed, 1e-9)))
+    samples = [await timed(loops) / loops for _ in range(REPEAT)]
+    return {
+        "loops": loops,
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "stdev": statistics.stdev(samples),
+    }
+
+
+async def run(database: str | None, selected: list[str]):
+    results: dict[str, Any] = {}
+    async with ClientSession() as session, ModulesManager(session) as modules:
+        db = None
+        if database:
+            db = OonoDatabase({"provider": "sqlite", "url": database})
+            await db.__aenter__()
+            await seed(db)
+        try:
+            state = BenchState(session=session, modules=modules, db=db)
+            for name, setup in BENCHMARKS.items():
+                if selected and not any(name.startswith(prefix) for prefix in selected):
+                    continue
+                func = await setup(state)
+                if func is None:
+                    print(f"{name:<32} skipped")
+                    continue
+                results[name] = await measure(func)
+                print(f"{name:<32} {results[name]['min'] * 1e6:12.3f} us")
+        finally:
+            if db is not None:
+                await db.__aexit__()
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "time": datetime.now().isoformat(),
+        "results": results,
+    }
+
+
+def compare(base: dict[str, Any], current: dict[str, Any], threshold: float) -> bool:
+    regressed = False
+    for name in sorted(base["results"].keys() | current["results"].keys()):
+        if name not in base["results"] or name not in current["results"]:
+            print(f"{name:<32} only in {'current' if name in current['results'] else 'base'}")
+            continue
+        before, after = base["results"][name]["min"], current["results"][name]["min"]
+        ratio = after / before
+        verdict = ""
+        if ratio > 1 + threshold:
+            verdict = "REGRESSION"
+            regressed = True
+        elif ratio < 1 - threshold:
+            verdict = "improved"
+        print(f"{name:<32} {before * 1e6:12.3f} us -> {after * 1e6:12.3f} us {ratio:7.2f}x {verdict}".rstrip())
+    return regressed
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        prog="python -m oono_akira.bench.micro", description="Microbenchmarks of dispatch hot paths"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="Run the benchmarks")
+    run_parser.add_argument("--database", help="URL of a SQLite database with the schema applied, to seed and query")
+    run_parser.add_argument("--output", metavar="FILE", help="Write the results to a JSON file")
+    run_parser.add_argument("benchmarks", nargs="*", help="Only run benchmarks with these name prefixes")
+    compare_parser = subparsers.add_parser("compare", help="Compare two result files")
+    compare_parser.add_argument("base", help="Results of the baseline run")
+    compare_parser.add_argument("current", help="Results of the run to check")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="Slowdown ratio flagged as regression")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        report = asyncio.run(run(args.database, args.benchmarks))
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+    else:
+        with open(args.base) as f:
+            base = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        sys.exit(1 if compare(base, current, args.threshold) else 0)
@@ -0,0 +1,78 @@
+import random
+import re
+import sys
+import time
+from typing import Callable
+
+from oono_akira.modules._02_paren import PAREN_MAPPING, find_unclosed
+
+PLAIN = [
+    "早上好",
+    "今天中午吃什么",
+    "lgtm, merging now",
+    "有人知道 staging 为什么挂了吗",
+    "ok",
+    "哈哈哈哈哈哈",
+    "<@U01ABCDEF> can you take a look at this?",
+    "see <https://example.com/some/long/path?query=1|the dashboard> for details",
+    "deployed to prod, watching the graphs",
+    "明天请假一天 <#C01ABCDEF|general>",
+]
+BRACKETS = [
+    "(这个其实不太对",
+    "我觉得可以「试一下",
+    "TODO: fix the retry logic (see <https://example.com/issues/1234>",
+    "run `foo(bar` and tell me what happens",
+    "【通知】今晚九点发版",
+    "你说的对（",
+    '```\nfor (i = 0; i < n; i++) {\n    printf("%d", a[i]);\n```\nthis crashes',
+]
+
+
+def legacy_find_unclosed(text: str) -> list[str]:
+    stack: list[str] = []
+    for char in re.sub(r"<@[0-9A-Za-z]+>", "", text):
+        if char in PAREN_MAPPING:
+            stack.append(PAREN_MAPPING[char])
+        elif stack and stack[-1] == char:
+            stack.pop()
+    return stack
+
+
+def make_corpora() -> dict[str, list[str]]:
+    rng = random.Random(0)
+    chat = [rng.choice(PLAIN) if rng.random() < 0.9 else rng.choice(BRACKETS) for _ in range(10000)]
+    log_line = "2024-01-01T00:00:00Z INFO request handled path=/api/v1/users status=200 (took 12ms) [worker-3]\n"
+    paste = "```\n" + log_line * 2000 + "```"
+    prose = "".join(rng.choice(PLAIN + BRACKETS) + "\n" for _ in range(2000))
+    return {
+        "chat messages": chat,
+        "bracket-free messages": [text for text in chat if not re.search(r"[(（「【0-9]", text)],
+        "code paste": [paste] * 10,
+        "prose paste": [prose] * 10,
+    }
+
+
+def run(func: Callable[[str], list[str]], texts: list[str]) -> float:
+    start = time.perf_counter()
+    for text in texts:
+        func(text)
+    return time.perf_counter() - start
+
+
+def main():
+    for name, texts in make_corpora().items():
+        size = sum(len(text) for text in texts)
+        legacy = min(run(legacy_find_unclosed, texts) for _ in range(3))
+        current = min(run(find_unclosed, texts) for _ in range(3))
+        print(
+            f"{name:<24} {len(texts):>6} texts, {size:>9} chars:"
+            f" legacy {legacy * 1e6 / len(texts):9.2f} us/text,"
+            f" current {current * 1e6 / len(texts):9.2f} us/text,"
+            f" {legacy / current:6.1f}x"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+import asyncio
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Generic, Hashable, TypeVar
+
+from oono_akira.metrics import CACHE_REQUESTS
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class AsyncCache(Generic[K, V]):
+    """LRU cache of asynchronously loaded values. Concurrent misses of one key share a single load."""
+
+    def __init__(self, maxsize: int, name: str = "", persist: bool = False):
+        self._maxsize = maxsize
+        self._name = name
+        # Whether loaded values are kept in the snapshot across restarts, they must be picklable
+        self.persist = persist
+        self._tasks: OrderedDict[K, asyncio.Future[V]] = OrderedDict()
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def __contains__(self, key: K):
+        return key in self._tasks
+
+    async def get(self, key: K, loader: Callable[[], Awaitable[V]]) -> V:
+        task = self._tasks.get(key)
+        if task is None:
+            CACHE_REQUESTS.inc(self._name, "miss")
+            task = asyncio.ensure_future(loader())
+            task.add_done_callback(lambda t: self._discard_failed(key, t))
+            self._tasks[key] = task
+            while len(self._tasks) > self._maxsize:
+                self._tasks.popitem(last=False)
+        else:
+            CACHE_REQUESTS.inc(self._name, "hit")
+            self._tasks.move_to_end(key)
+        # The load is shared, so a cancelled caller must not cancel it for everyone else
+        return await asyncio.shield(task)
+
+    def clear(self):
+        self._tasks.clear()
+
+    def items(self) -> list[tuple[K, V]]:
+        # Loaded values only, least recently used first
+        return [
+            (key, task.result())
+            for key, task in self._tasks.items()
+            if task.done() and not task.cancelled() and task.exception() is None
+        ]
+
+    def put(self, key: K, value: V):
+        task: asyncio.Future[V] = asyncio.get_running_loop().create_future()
+        task.set_result(value)
+        self._tasks[key] = task
+        self._tasks.move_to_end(key)
+        while len(self._tasks) > self._maxsize:
+            self._tasks.popitem(last=False)
+
+    def _discard_failed(self, key: K, task: asyncio.Future[V]):
+        if task.cancelled() or task.exception() is not None:
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+
+
+class CacheService:
+    """Registry of named caches shared by modules."""
+
+    def __init__(self):
+        self._caches: dict[str, AsyncCache[Any, Any]] = {}
+        # Restored items of caches that modules loaded later have yet to ask for
+        self._restored: dict[str, list[tuple[Any, Any]]] = {}
+
+    def get(self, name: str, maxsize: int, persist: bool = False) -> AsyncCache[Any, Any]:
+        if name not in self._caches:
+            cache = self._caches[name] = AsyncCache(maxsize, name, persist)
+            for key, value in self._restored.pop(name, []) if persist else []:
+                cache.put(key, value)
+        return self._caches[name]
+
+    def dump(self) -> dict[str, list[tuple[Any, Any]]]:
+        # Restored items no module asked for are kept for the next snapshot
+        return {**self._restored, **{name: cache.items() for name, cache in self._caches.items() if cache.persist}}
+
+    def restore(self, state: dict[str, list[tuple[Any, Any]]]):
+        for name, items in state.items():
+            cache = self._caches.get(name)
+            if cache is None:
+                self._restored[name] = items
+            elif cache.persist:
+                for key, value in items:
+                    cache.put(key, value)
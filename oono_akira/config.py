@@ -1,4 +1,4 @@
-from typing import Sequence, TypedDict
+from typing import Mapping, NotRequired, Sequence, TypedDict
 
 
 class ServerSslConfiguration(TypedDict):
@@ -22,9 +22,71 @@ class SlackConfiguration(TypedDict):
     redirect_uri: str
     token: str
     permissions: Sequence[str]
+    api_url: NotRequired[str]
+    signing_secret: NotRequired[str]
+    mode: NotRequired[str]
+
+
+class TracingConfiguration(TypedDict):
+    path: str
+    sample_rate: NotRequired[float]
+    slow_threshold: NotRequired[float]
+
+
+class RuntimeConfiguration(TypedDict):
+    loop: NotRequired[str]
+    json: NotRequired[str]
+    # Seconds shutdown waits for handlers, acks and background writes before dropping them
+    drain_timeout: NotRequired[float]
+
+
+class ShardingConfiguration(TypedDict):
+    workers: int
+
+
+class SandboxConfiguration(TypedDict):
+    # Peak RSS in megabytes, after which the worker is replaced
+    memory_limit: NotRequired[int]
+
+
+class ModulesConfiguration(TypedDict):
+    # Seconds between checks of the modules directory, changed modules are reloaded in place
+    reload_interval: NotRequired[float]
+
+
+class DedupConfiguration(TypedDict):
+    # SQLite file shared by the instances on a host, only kept in memory without it
+    path: NotRequired[str]
+    ttl: NotRequired[float]
+    inflight_timeout: NotRequired[float]
+
+
+class ArchiveConfiguration(TypedDict):
+    path: str
+    # Seconds payloads stay in the database before they are archived
+    retention: NotRequired[float]
+    # Seconds between compactions, 0 to only sample in this instance
+    interval: NotRequired[float]
+    # Payload kind or type, like "events_api/message" or "slash_commands", to the fraction of them recorded
+    sample: NotRequired[Mapping[str, float]]
+
+
+class SnapshotConfiguration(TypedDict):
+    path: str
+    # Seconds after which a snapshot is too old to restore
+    max_age: NotRequired[float]
 
 
 class Configuration(TypedDict):
     server: ServerConfiguration
     database: DatabaseConfiguration
     slack: SlackConfiguration
+    tracing: NotRequired[TracingConfiguration]
+    runtime: NotRequired[RuntimeConfiguration]
+    sharding: NotRequired[ShardingConfiguration]
+    modules: NotRequired[ModulesConfiguration]
+    # Module name to sandbox options
+    sandbox: NotRequired[Mapping[str, SandboxConfiguration]]
+    dedup: NotRequired[DedupConfiguration]
+    archive: NotRequired[ArchiveConfiguration]
+    snapshot: NotRequired[SnapshotConfiguration]
@@ -1,7 +1,8 @@
-import json
 from contextlib import asynccontextmanager
+from datetime import datetime
 from typing import Any
 
+from oono_akira import speedups
 from oono_akira.config import DatabaseConfiguration
 from oono_akira.db.prisma import Prisma
 
@@ -22,7 +23,7 @@ class OonoDatabase:
 
     async def record_payload(self, source: str, content: str | Any):
         if not isinstance(content, str):
-            content = json.dumps(content)
+            content = speedups.dumps(content)
         return await self._client.payload.create(
             data={
                 "source": source,
@@ -30,6 +31,31 @@ class OonoDatabase:
             }
         )
 
+    async def iterate_payloads(self, sources: list[str], batch: int = 1000):
+        cursor: str | None = None
+        while True:
+            payloads = await self._client.payload.find_many(
+                where={"source": {"in": sources}},
+                order=[{"createdAt": "asc"}, {"id": "asc"}],
+                take=batch,
+                **({"cursor": {"id": cursor}, "skip": 1} if cursor is not None else {}),
+            )
+            for payload in payloads:
+                yield payload
+            if len(payloads) < batch:
+                return
+            cursor = payloads[-1].id
+
+    async def get_payloads_before(self, before: datetime, batch: int = 1000):
+        return await self._client.payload.find_many(
+            where={"createdAt": {"lt": before}},
+            order=[{"createdAt": "asc"}, {"id": "asc"}],
+            take=batch,
+        )
+
+    async def delete_payloads(self, ids: list[str]):
+        return await self._client.payload.delete_many(where={"id": {"in": ids}})
+
     async def setup_workspace(self, id: str, name: str, bot_id: str, admin_id: str, token: str, hook_url: str):
         return await self._client.workspace.upsert(
             where={
@@ -204,17 +230,24 @@ class OonoDatabase:
 
     @asynccontextmanager
     async def get_session(self, **kwargs: str):
+        data = await self.load_session(**kwargs)
+        yield data
+        await self.save_session(data, **kwargs)
+
+    async def load_session(self, **kwargs: str) -> Any:
         key = ",".join(f"{key}={value}" for key, value in sorted(kwargs.items()))
         session = await self._client.session.upsert(
             where={"key": key},
             data={"create": {"key": key, "content": "{}"}, "update": {}},
         )
-        data = json.loads(session.content)
-        yield data
+        return speedups.loads(session.content)
+
+    async def save_session(self, data: Any, **kwargs: str):
+        key = ",".join(f"{key}={value}" for key, value in sorted(kwargs.items()))
         if data:
             await self._client.session.update(
                 where={"key": key},
-                data={"content": json.dumps(data)},
+                data={"content": speedups.dumps(data)},
             )
         else:
             await self._client.session.delete(
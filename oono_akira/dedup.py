@@ -0,0 +1,195 @@
+import asyncio
+import sqlite3
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from oono_akira.config import DedupConfiguration
+from oono_akira.log import log
+
+
+@dataclass(slots=True)
+class DedupEntry:
+    processor: str
+    claimed: float
+    done: bool = False
+    # False when another instance sharing the store has it, which is then only remembered to answer redeliveries
+    owned: bool = True
+
+
+class DedupStore:
+    """Remembers envelopes for a time window, so redeliveries are skipped, in memory and optionally in SQLite.
+
+    An envelope is claimed when it arrives and done once it is acked. A redelivery of a done envelope, or of one
+    claimed less than inflight_timeout ago, is a duplicate. One claimed longer ago was never acked, so it can be
+    claimed again. With a path, claims go through a SQLite file shared by every instance on the host.
+    """
+
+    DEFAULT_TTL = 600
+    DEFAULT_INFLIGHT_TIMEOUT = 60
+    # How often expired rows are deleted from the shared store
+    PURGE_INTERVAL = 60
+
+    def __init__(self, config: DedupConfiguration | None = None):
+        config = config or {}
+        self._path = config.get("path")
+        self._ttl = config.get("ttl", self.DEFAULT_TTL)
+        self._inflight_timeout = config.get("inflight_timeout", self.DEFAULT_INFLIGHT_TIMEOUT)
+        # Oldest claim first, so expired entries are always at the front
+        self._entries: dict[str, DedupEntry] = {}
+        self._db: sqlite3.Connection | None = None
+        self._executor: ThreadPoolExecutor | None = None
+        self._purged = 0.0
+
+    async def __aenter__(self):
+        if self._path is not None:
+            # The connection lives on one thread, which also keeps writes in order
+            self._executor = ThreadPoolExecutor(1, thread_name_prefix="oono-dedup")
+            await asyncio.wrap_future(self._executor.submit(self._connect, self._path))
+        return self
+
+    async def __aexit__(self, *_):
+        if self._executor is not None:
+            await asyncio.wrap_future(self._executor.submit(self._close))
+            self._executor.shutdown()
+
+    def counts(self) -> dict[str, int]:
+        counts = {"done": 0, "inflight": 0, "elsewhere": 0}
+        for entry in self._entries.values():
+            counts["elsewhere" if not entry.owned else "done" if entry.done else "inflight"] += 1
+        return counts
+
+    async def claim(self, key: str, processor: str = "unknown") -> str | None:
+        # Returns None when the envelope is ours to process, or the processor of the earlier delivery
+        now = time.time()
+        existing = self._claim_local(key, processor, now)
+        if existing is not None or self._executor is None:
+            return existing
+        try:
+            existing = await asyncio.wrap_future(self._executor.submit(self._claim_shared, key, processor, now))
+        except Exception:
+            self._entries.pop(key, None)
+            raise
+        # Released meanwhile, like on shutdown, the release is queued behind the claim and undoes it
+        entry = self._entries.get(key)
+        if existing is not None and entry is not None:
+            # Another instance has it, further redeliveries to this one are answered from memory
+            entry.processor = existing
+            entry.owned = False
+        return existing
+
+    def update(self, key: str, processor: str):
+        entry = self._entries.get(key)
+        if entry is not None and entry.owned:
+            entry.processor = processor
+            self._submit(self._update_shared, key, processor)
+
+    def finish(self, key: str):
+        entry = self._entries.get(key)
+        if entry is not None and entry.owned and not entry.done:
+            entry.done = True
+            self._submit(self._finish_shared, key)
+
+    def release(self, key: str):
+        # Processing failed before the ack, so a redelivery gets another try. Only claims of this instance are
+        # released, the shared row of another one's is left alone.
+        entry = self._entries.pop(key, None)
+        if entry is not None and entry.owned:
+            self._submit(self._release_shared, key)
+
+    def release_inflight(self) -> int:
+        # On shutdown, so that Slack's redelivery of what was never acked is processed by another instance
+        keys = [key for key, entry in self._entries.items() if entry.owned and not entry.done]
+        for key in keys:
+            self.release(key)
+        return len(keys)
+
+    def dump(self) -> list[tuple[str, str, float]]:
+        # Entries still in flight were never acked, so Slack redelivers them and they are left out
+        return [
+            (key, entry.processor, entry.claimed) for key, entry in self._entries.items() if entry.owned and entry.done
+        ]
+
+    def restore(self, entries: list[tuple[str, str, float]]):
+        for key, processor, claimed in entries:
+            if key not in self._entries:
+                self._entries[key] = DedupEntry(processor, claimed, True)
+        self._expire(time.time())
+
+    def _claimable(self, entry: DedupEntry, now: float) -> bool:
+        return now - entry.claimed >= (self._ttl if entry.done else self._inflight_timeout)
+
+    def _claim_local(self, key: str, processor: str, now: float) -> str | None:
+        self._expire(now)
+        entry = self._entries.get(key)
+        if entry is not None:
+            if not self._claimable(entry, now):
+                return entry.processor
+            del self._entries[key]
+        self._entries[key] = DedupEntry(processor, now)
+        return None
+
+    def _expire(self, now: float):
+        while self._entries:
+            key = next(iter(self._entries))
+            if now - self._entries[key].claimed < self._ttl:
+                break
+            del self._entries[key]
+        if self._executor is not None and now - self._purged > self.PURGE_INTERVAL:
+            self._purged = now
+            self._submit(self._purge_shared, now)
+
+    def _submit(self, func: Callable[..., Any], *args: Any):
+        # Shared writes after a claim don't hold up dispatch, failures are only logged
+        if self._executor is not None:
+            self._executor.submit(func, *args).add_done_callback(self._submit_done)
+
+    @staticmethod
+    def _submit_done(future: Future[Any]):
+        if future.exception() is not None:
+            log(f"Dedup store write failed: {future.exception()!r}", level="error")
+
+    def _connect(self, path: str):
+        self._db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA synchronous = NORMAL")
+        self._db.execute("PRAGMA busy_timeout = 5000")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS dedup ("
+            "key TEXT PRIMARY KEY, processor TEXT NOT NULL, claimed REAL NOT NULL, done INTEGER NOT NULL DEFAULT 0)"
+        )
+
+    def _close(self):
+        assert self._db is not None
+        self._db.close()
+
+    def _claim_shared(self, key: str, processor: str, now: float) -> str | None:
+        assert self._db is not None
+        # Taken over only when the row expired or its claim was never acked, which one statement decides atomically
+        cursor = self._db.execute(
+            "INSERT INTO dedup (key, processor, claimed, done) VALUES (?, ?, ?, 0) "
+            "ON CONFLICT (key) DO UPDATE SET processor = excluded.processor, claimed = excluded.claimed, done = 0 "
+            "WHERE claimed < ? OR (done = 0 AND claimed < ?)",
+            (key, processor, now, now - self._ttl, now - self._inflight_timeout),
+        )
+        if cursor.rowcount == 1:
+            return None
+        row = self._db.execute("SELECT processor FROM dedup WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else processor
+
+    def _update_shared(self, key: str, processor: str):
+        assert self._db is not None
+        self._db.execute("UPDATE dedup SET processor = ? WHERE key = ?", (processor, key))
+
+    def _finish_shared(self, key: str):
+        assert self._db is not None
+        self._db.execute("UPDATE dedup SET done = 1 WHERE key = ?", (key,))
+
+    def _release_shared(self, key: str):
+        assert self._db is not None
+        self._db.execute("DELETE FROM dedup WHERE key = ?", (key,))
+
+    def _purge_shared(self, now: float):
+        assert self._db is not None
+        self._db.execute("DELETE FROM dedup WHERE claimed < ?", (now - self._ttl,))
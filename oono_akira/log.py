@@ -1,10 +1,99 @@
+import atexit
+import json
 import os
+import queue
+import random
 import sys
+import threading
+import time
 from datetime import datetime
+from typing import Any
 
+# Records are formatted and written by a background thread, so a slow stderr never blocks the event loop
+LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
 DEBUG = os.environ.get("OONO_DEBUG") in {"1", "ON"}
+LEVEL = LEVELS[os.environ.get("OONO_LOG_LEVEL", "debug" if DEBUG else "info").lower()]
+JSON = os.environ.get("OONO_LOG_FORMAT", "text").lower() == "json"
+# Per category sample rates, like "event=0.1,api=0.5", categories not listed are always logged
+SAMPLE = {
+    category.strip(): float(rate)
+    for category, _, rate in (item.partition("=") for item in os.environ.get("OONO_LOG_SAMPLE", "").split(","))
+    if rate
+}
+QUEUE_SIZE = 10000
 
+Record = tuple[float, str, str, str, dict[str, Any]]
 
-def log(s: str, debug: bool = False):
-    if not debug or debug and DEBUG:
-        print(f"[{datetime.now().isoformat()}] {s}", file=sys.stderr)
+_queue: queue.Queue[Record | None] = queue.Queue(QUEUE_SIZE)
+_writer: threading.Thread | None = None
+_lock = threading.Lock()
+_dropped = 0
+
+
+def log(s: str, debug: bool = False, *, level: str = "info", category: str = "", **fields: Any):
+    global _dropped
+    if debug:
+        level = "debug"
+    if LEVELS[level] < LEVEL:
+        return
+    if category in SAMPLE and random.random() >= SAMPLE[category]:
+        return
+    if _writer is None:
+        _start()
+    try:
+        _queue.put_nowait((time.time(), level, category, s, fields))
+    except queue.Full:
+        # Dropping is better than stalling the loop, the count is reported with the next record written
+        _dropped += 1
+
+
+def flush():
+    # Waits for everything logged so far to be written
+    if _writer is not None:
+        _queue.join()
+
+
+def _start():
+    global _writer
+    with _lock:
+        if _writer is None:
+            _writer = threading.Thread(target=_write, name="oono-log", daemon=True)
+            _writer.start()
+            atexit.register(_stop)
+
+
+def _stop():
+    assert _writer is not None
+    _queue.put(None)
+    _writer.join()
+
+
+def _format(record: Record) -> str:
+    created, level, category, message, fields = record
+    timestamp = datetime.fromtimestamp(created).isoformat()
+    if JSON:
+        return json.dumps(
+            {"time": timestamp, "level": level, "category": category, "message": message, **fields},
+            ensure_ascii=False,
+            default=str,
+        )
+    prefix = "" if level == "info" else f"{level.upper()}: "
+    extra = "".join(f" {key}={value}" for key, value in fields.items())
+    return f"[{timestamp}] {prefix}{message}{extra}"
+
+
+def _write():
+    global _dropped
+    while True:
+        record = _queue.get()
+        if record is None:
+            _queue.task_done()
+            return
+        lines = [_format(record)]
+        if _dropped:
+            dropped, _dropped = _dropped, 0
+            lines.append(_format((time.time(), "warning", "log", f"Dropped {dropped} log records", {})))
+        try:
+            print("\n".join(lines), file=sys.stderr, flush=True)
+        finally:
+            _queue.task_done()
@@ -0,0 +1,226 @@
+import re
+from datetime import date, timedelta
+from itertools import accumulate
+
+LunarDate = tuple[str, str, str, str | None]
+
+TABLE_START = 1900
+YEAR_MIN = 1901
+YEAR_MAX = 2100
+
+HEAVENLY_STEMS = "甲乙丙丁戊己庚辛壬癸"
+EARTHLY_BRANCHES = "子丑寅卯辰巳午未申酉戌亥"
+MONTH_NAMES = ["正月", "二月", "三月", "四月", "五月", "六月", "七月", "八月", "九月", "十月", "十一月", "十二月"]
+DAY_NAMES = (
+    [f"初{c}" for c in "一二三四五六七八九十"]
+    + [f"十{c}" for c in "一二三四五六七八九"]
+    + ["二十"]
+    + [f"廿{c}" for c in "一二三四五六七八九"]
+    + ["三十"]
+)
+SOLAR_TERM_NAMES = [
+    *["小寒", "大寒", "立春", "雨水", "惊蛰", "春分", "清明", "谷雨", "立夏", "小满", "芒种", "夏至"],
+    *["小暑", "大暑", "立秋", "处暑", "白露", "秋分", "寒露", "霜降", "立冬", "小雪", "大雪", "冬至"],
+]
+
+# One entry per lunar year since 1900, whose first day is 1900-01-31. Bits 15 to 4 tell whether the first to the
+# twelfth month has 30 days, bits 3 to 0 are the leap month (0 if there is none) and bit 16 is the leap month size.
+LUNAR_INFO_EPOCH = date(1900, 1, 31)
+# fmt: off
+LUNAR_INFO = [
+    0x04BD8, 0x04AE0, 0x0A570, 0x054D5, 0x0D260, 0x0D950, 0x16554, 0x056A0, 0x09AD0, 0x055D2,  # 1900-1909
+    0x04AE0, 0x0A5B6, 0x0A4D0, 0x0D250, 0x1D255, 0x0B540, 0x0D6A0, 0x0ADA2, 0x095B0, 0x14977,  # 1910-1919
+    0x04970, 0x0A4B0, 0x0B4B5, 0x06A50, 0x06D40, 0x1AB54, 0x02B60, 0x09570, 0x052F2, 0x04970,  # 1920-1929
+    0x06566, 0x0D4A0, 0x0EA50, 0x16A95, 0x05AD0, 0x02B60, 0x186E3, 0x092E0, 0x1C8D7, 0x0C950,  # 1930-1939
+    0x0D4A0, 0x1D8A6, 0x0B550, 0x056A0, 0x1A5B4, 0x025D0, 0x092D0, 0x0D2B2, 0x0A950, 0x0B557,  # 1940-1949
+    0x06CA0, 0x0B550, 0x15355, 0x04DA0, 0x0A5B0, 0x14573, 0x052B0, 0x0A9A8, 0x0E950, 0x06AA0,  # 1950-1959
+    0x0AEA6, 0x0AB50, 0x04B60, 0x0AAE4, 0x0A570, 0x05260, 0x0F263, 0x0D950, 0x05B57, 0x056A0,  # 1960-1969
+    0x096D0, 0x04DD5, 0x04AD0, 0x0A4D0, 0x0D4D4, 0x0D250, 0x0D558, 0x0B540, 0x0B6A0, 0x195A6,  # 1970-1979
+    0x095B0, 0x049B0, 0x0A974, 0x0A4B0, 0x0B27A, 0x06A50, 0x06D40, 0x0AF46, 0x0AB60, 0x09570,  # 1980-1989
+    0x04AF5, 0x04970, 0x064B0, 0x074A3, 0x0EA50, 0x06B58, 0x05AC0, 0x0AB60, 0x096D5, 0x092E0,  # 1990-1999
+    0x0C960, 0x0D954, 0x0D4A0, 0x0DA50, 0x07552, 0x056A0, 0x0ABB7, 0x025D0, 0x092D0, 0x0CAB5,  # 2000-2009
+    0x0A950, 0x0B4A0, 0x0BAA4, 0x0AD50, 0x055D9, 0x04BA0, 0x0A5B0, 0x15176, 0x052B0, 0x0A930,  # 2010-2019
+    0x07954, 0x06AA0, 0x0AD50, 0x05B52, 0x04B60, 0x0A6E6, 0x0A4E0, 0x0D260, 0x0EA65, 0x0D530,  # 2020-2029
+    0x05AA0, 0x076A3, 0x096D0, 0x04AFB, 0x04AD0, 0x0A4D0, 0x1D0B6, 0x0D250, 0x0D520, 0x0DD45,  # 2030-2039
+    0x0B5A0, 0x056D0, 0x055B2, 0x049B0, 0x0A577, 0x0A4B0, 0x0AA50, 0x1B255, 0x06D20, 0x0ADA0,  # 2040-2049
+    0x14B63, 0x09370, 0x049F8, 0x04970, 0x064B0, 0x168A6, 0x0EA50, 0x06AA0, 0x1A6C4, 0x0AAE0,  # 2050-2059
+    0x092E0, 0x0D2E3, 0x0C960, 0x0D557, 0x0D4A0, 0x0DA50, 0x05D55, 0x056A0, 0x0A6D0, 0x055D4,  # 2060-2069
+    0x052D0, 0x0A9B8, 0x0A950, 0x0B4A0, 0x0B6A6, 0x0AD50, 0x055A0, 0x0ABA4, 0x0A5B0, 0x052B0,  # 2070-2079
+    0x0B273, 0x06930, 0x07337, 0x06AA0, 0x0AD50, 0x14B55, 0x04B60, 0x0A570, 0x054E4, 0x0D160,  # 2080-2089
+    0x0E968, 0x0D520, 0x0DAA0, 0x16AA6, 0x056D0, 0x04AE0, 0x0A9D4, 0x0A2D0, 0x0D150, 0x0F252,  # 2090-2099
+    0x0D520,  # 2100
+]
+# fmt: on
+
+# One entry per Gregorian year since 1900. Every two bits, from the lowest, hold the day of a solar term in the
+# order of SOLAR_TERM_NAMES, as an offset from the earliest day that term falls on in SOLAR_TERM_BASE.
+SOLAR_TERM_BASE = [4, 19, 3, 18, 4, 19, 4, 19, 4, 20, 4, 20, 6, 22, 6, 22, 6, 22, 7, 22, 6, 21, 6, 21]
+# fmt: off
+SOLAR_TERM_INFO = [
+    0x5AA665A65A56, 0x6AAAA6AA9A5A, 0xAAAAAABAAA6A, 0xAAABBABBAFAA, 0x5AA665A65AAB,  # 1900-1904
+    0x6AAAA6AA9A5A, 0xAAAAAAAAAA6A, 0xAAABBABBAFAA, 0x5AA665A65AAB, 0x6AAAA6AA9A5A,  # 1905-1909
+    0xAAAAAAAAAA6A, 0xAAABBABBAFAA, 0x56A665A65AAB, 0x6AA6A6AA9A56, 0xAAAAAAAA9A5A,  # 1910-1914
+    0xAAABAABAAEAA, 0x569665A65AAA, 0x6AA6A6A69A56, 0x6AAAAAAA9A5A, 0xAAABAABAAEAA,  # 1915-1919
+    0x569665A65AAA, 0x5AA6A6A65A56, 0x6AAAAAAA9A5A, 0xAAABAABAAA6A, 0x569665A65AAA,  # 1920-1924
+    0x5AA6A6A65A56, 0x6AAAA6AA9A5A, 0xAAABAABAAA6A, 0x555665A65AAA, 0x5AA665A65A56,  # 1925-1929
+    0x6AAAA6AA9A5A, 0xAAAAAABAAA6A, 0x555665665AAA, 0x5AA665A65A56, 0x6AAAA6AA9A5A,  # 1930-1934
+    0xAAAAAAAAAA6A, 0x555665665AAA, 0x5AA665A65A56, 0x6AAAA6AA9A5A, 0xAAAAAAAAAA6A,  # 1935-1939
+    0x555665665AAA, 0x5AA665A65A56, 0x6AAAA6AA9A5A, 0xAAAAAAAAAA6A, 0x555665655AAA,  # 1940-1944
+    0x569665A65A56, 0x6AA6A6AA9A56, 0xAAAAAAAA9A5A, 0x5556556559AA, 0x569665A65A55,  # 1945-1949
+    0x6AA6A6A65A56, 0xAAAAAAAA9A5A, 0x5556556559AA, 0x569665A65A55, 0x5AA6A6A65A56,  # 1950-1954
+    0x6AAAA6AA9A5A, 0x5556556555AA, 0x569665A65A55, 0x5AA665A65A56, 0x6AAAA6AA9A5A,  # 1955-1959
+    0x55555565556A, 0x555665665A55, 0x5AA665A65A56, 0x6AAAA6AA9A5A, 0x55555565556A,  # 1960-1964
+    0x555665665A55, 0x5AA665A65A56, 0x6AAAA6AA9A5A, 0x55555555556A, 0x555665665A55,  # 1965-1969
+    0x5AA665A65A56, 0x6AAAA6AA9A5A, 0x55555555556A, 0x555665655A55, 0x5AA665A65A56,  # 1970-1974
+    0x6AA6A6AA9A5A, 0x55555555456A, 0x555655655A55, 0x5A9665A65A56, 0x6AA6A6A69A56,  # 1975-1979
+    0x55555555456A, 0x555655655A55, 0x569665A65A56, 0x6AA6A6A65A56, 0x55555155455A,  # 1980-1984
+    0x555655655955, 0x569665A65A55, 0x5AA6A5A65A56, 0x15555155455A, 0x555555655555,  # 1985-1989
+    0x569665665A55, 0x5AA665A65A56, 0x15555155455A, 0x555555655515, 0x555665665A55,  # 1990-1994
+    0x5AA665A65A56, 0x15555155455A, 0x555555555515, 0x555665665A55, 0x5AA665A65A56,  # 1995-1999
+    0x15555155455A, 0x555555555515, 0x555665665A55, 0x5AA665A65A56, 0x15555155455A,  # 2000-2004
+    0x555555555515, 0x555655655A55, 0x5AA665A65A56, 0x15515155455A, 0x555555554515,  # 2005-2009
+    0x555655655A55, 0x5A9665A65A56, 0x15515151455A, 0x555551554515, 0x555655655A55,  # 2010-2014
+    0x569665A65A56, 0x155151510556, 0x555551554505, 0x555655655955, 0x569665665A55,  # 2015-2019
+    0x155110510556, 0x155551554505, 0x555555655555, 0x569665665A55, 0x055110510556,  # 2020-2024
+    0x155551554505, 0x555555555515, 0x555665665A55, 0x055110510556, 0x155551554505,  # 2025-2029
+    0x555555555515, 0x555665665A55, 0x055110510556, 0x155551554505, 0x555555555515,  # 2030-2034
+    0x555655655A55, 0x055110510556, 0x155551554505, 0x555555555515, 0x555655655A55,  # 2035-2039
+    0x055110510556, 0x155151514505, 0x555555554515, 0x555655655A55, 0x054110510556,  # 2040-2044
+    0x155151510505, 0x555551554515, 0x555655655A55, 0x014110110556, 0x155110510501,  # 2045-2049
+    0x555551554505, 0x555555655555, 0x014110110555, 0x155110510501, 0x555551554505,  # 2050-2054
+    0x555555555555, 0x014110110555, 0x055110510501, 0x155551554505, 0x555555555555,  # 2055-2059
+    0x000110110555, 0x055110510501, 0x155551554505, 0x555555555515, 0x000110110555,  # 2060-2064
+    0x055110510501, 0x155551554505, 0x555555555515, 0x000100100555, 0x055110510501,  # 2065-2069
+    0x155151514505, 0x555555555515, 0x000100100555, 0x054110510501, 0x155151514505,  # 2070-2074
+    0x555551554515, 0x000100100555, 0x054110510501, 0x155150510505, 0x555551554515,  # 2075-2079
+    0x000100100555, 0x014110110501, 0x155110510505, 0x555551554505, 0x000000100055,  # 2080-2084
+    0x014110110500, 0x155110510501, 0x555551554505, 0x000000000055, 0x014110110500,  # 2085-2089
+    0x055110510501, 0x155551554505, 0x000000000055, 0x000110110500, 0x055110510501,  # 2090-2094
+    0x155551554505, 0x000000000015, 0x000100110500, 0x055110510501, 0x155551554505,  # 2095-2099
+    0x555555555515,  # 2100
+]
+# fmt: on
+
+HKO_CALENDAR_URL = "https://www.hko.gov.hk/tc/gts/time/calendar/text/files/T{year}c.txt"
+RE_HKO_TITLE = re.compile(r"\d{4}\((\S\S) - 肖\S\)年公曆與農曆日期對照表")
+RE_HKO_DATE = re.compile(r"^(\d+)年(\d+)月(\d+)日\s+(\S+)\s+星期\S\s+(?:(\S+)\s+)?$")
+HKO_MAPPING: dict[str, str] = dict(
+    [("驚蟄", "惊蛰"), ("穀雨", "谷雨"), ("小滿", "小满"), ("芒種", "芒种"), ("處暑", "处暑")]
+)
+
+
+def get_months(lunar_year: int) -> list[tuple[str, int]]:
+    info = LUNAR_INFO[lunar_year - TABLE_START]
+    leap = info & 0xF
+    months: list[tuple[str, int]] = []
+    for month in range(1, 13):
+        months.append((MONTH_NAMES[month - 1], 30 if info & (0x10000 >> month) else 29))
+        if month == leap:
+            months.append((f"闰{MONTH_NAMES[month - 1]}", 30 if info & 0x10000 else 29))
+    return months
+
+
+def get_year_name(lunar_year: int) -> str:
+    return HEAVENLY_STEMS[(lunar_year - 4) % 10] + EARTHLY_BRANCHES[(lunar_year - 4) % 12]
+
+
+def get_solar_terms(year: int) -> dict[tuple[int, int], str]:
+    info = SOLAR_TERM_INFO[year - TABLE_START]
+    return {
+        (index // 2 + 1, SOLAR_TERM_BASE[index] + (info >> (index * 2) & 3)): name
+        for index, name in enumerate(SOLAR_TERM_NAMES)
+    }
+
+
+LUNAR_NEW_YEAR = [
+    LUNAR_INFO_EPOCH + timedelta(days=offset)
+    for offset in accumulate(
+        (sum(days for _, days in get_months(year)) for year in range(TABLE_START, TABLE_START + len(LUNAR_INFO))),
+        initial=0,
+    )
+]
+
+
+def get_lunar_year(year: int) -> dict[tuple[int, int, int], LunarDate]:
+    """Compute the lunar date and solar term of every day in a Gregorian year."""
+    if year < YEAR_MIN or year > YEAR_MAX:
+        raise ValueError(f"year out of supported range: {year}")
+    terms = get_solar_terms(year)
+    first, last = date(year, 1, 1), date(year, 12, 31)
+    current = LUNAR_NEW_YEAR[year - 1 - TABLE_START]
+    mapping: dict[tuple[int, int, int], LunarDate] = {}
+    for lunar_year in (year - 1, year):
+        year_name = get_year_name(lunar_year)
+        for month_name, days in get_months(lunar_year):
+            if current + timedelta(days=days) <= first:
+                current += timedelta(days=days)
+                continue
+            for day in range(days):
+                if first <= current <= last:
+                    key = (current.year, current.month, current.day)
+                    mapping[key] = (year_name, month_name, DAY_NAMES[day], terms.get(key[1:]))
+                current += timedelta(days=1)
+    return mapping
+
+
+def parse_hko_tables(last_data: str, this_data: str) -> dict[tuple[int, int, int], LunarDate]:
+    """Parse the HKO Gregorian-lunar conversion tables of a year and its previous year."""
+    mapping: dict[tuple[int, int, int], LunarDate] = {}
+    last_lines, this_lines = last_data.split("\r\n"), this_data.split("\r\n")
+    last_name_match, this_name_match = RE_HKO_TITLE.fullmatch(last_lines[0]), RE_HKO_TITLE.fullmatch(this_lines[0])
+    if last_name_match is None or this_name_match is None:
+        raise RuntimeError("failed to get year name")
+    last_year, this_year = last_name_match.group(1), this_name_match.group(1)
+    current_year = last_year
+    current_month = None
+    for line in last_lines[-2:2:-1]:
+        date_match = RE_HKO_DATE.fullmatch(line)
+        if date_match is None:
+            raise RuntimeError(f"failed to parse date line: {line}")
+        day = date_match.group(4)
+        if day[-1] == "月":
+            current_month = day.replace("閏", "闰")
+            break
+    else:
+        raise RuntimeError(f"failed to find month of last year")
+    for line in this_lines[3:-1]:
+        date_match = RE_HKO_DATE.fullmatch(line)
+        if date_match is None:
+            raise RuntimeError(f"failed to parse date line: {line}")
+        year_s, month_s, day_s, current_day, day_term = date_match.groups()
+        if current_day == "正月":
+            current_year = this_year
+        if current_day[-1] == "月":
+            current_month = current_day.replace("閏", "闰")
+            current_day = "初一"
+        day_term = HKO_MAPPING.get(day_term, day_term)
+        mapping[(int(year_s), int(month_s), int(day_s))] = (current_year, current_month, current_day, day_term)
+    return mapping
+
+
+if __name__ == "__main__":
+    import asyncio
+    import sys
+
+    import aiohttp
+
+    async def validate(years: list[int]):
+        async with aiohttp.ClientSession() as session:
+
+            async def fetch(year: int):
+                async with session.get(HKO_CALENDAR_URL.format(year=year)) as resp:
+                    resp.raise_for_status()
+                    return await resp.text("big5")
+
+            failed = False
+            for year in years:
+                expected = parse_hko_tables(*await asyncio.gather(fetch(year - 1), fetch(year)))
+                actual = get_lunar_year(year)
+                for key in sorted(expected.keys() | actual.keys()):
+                    if expected.get(key) != actual.get(key):
+                        print(f"{key}: expected {expected.get(key)}, got {actual.get(key)}")
+                        failed = True
+                print(f"Validated {year} against HKO, {len(expected)} days")
+            return failed
+
+    sys.exit(asyncio.run(validate([int(arg) for arg in sys.argv[1:]])))
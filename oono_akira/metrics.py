@@ -0,0 +1,150 @@
+from bisect import bisect_left
+from collections import deque
+from typing import Callable, Mapping, Sequence
+
+# Slack retries an envelope that isn't acked in 3 seconds, so the buckets are denser around it
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 2.5, 3.0, 5.0, 10.0)
+
+Labels = tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Labels, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values: dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+        window: int = 0,
+    ):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # Per label values: non-cumulative bucket counts (the last one is +Inf), sum and count
+        self.values: dict[Labels, tuple[list[int], list[float]]] = {}
+        # The most recent observations are also kept when a window is given, for exact percentiles
+        self.window = window
+        self.recent: dict[Labels, deque[float]] = {}
+
+    def observe(self, value: float, *labels: str):
+        if labels not in self.values:
+            self.values[labels] = [0] * (len(self.buckets) + 1), [0.0, 0.0]
+            if self.window:
+                self.recent[labels] = deque(maxlen=self.window)
+        counts, total = self.values[labels]
+        counts[bisect_left(self.buckets, value)] += 1
+        total[0] += value
+        total[1] += 1
+        if self.window:
+            self.recent[labels].append(value)
+
+    def percentiles(self, ps: Sequence[float], *labels: str) -> list[float]:
+        # Over the recent window only
+        ordered = sorted(self.recent.get(labels, ()))
+        if not ordered:
+            return [0.0 for _ in ps]
+        return [ordered[min(len(ordered) - 1, int(len(ordered) * p))] for p in ps]
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                bucket = _format_labels(self.labels, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{bucket} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {total[0]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, labels)} {int(total[1])}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        # Gauges are read when rendered, each owner registers a function under its own key
+        self.functions: dict[str, Callable[[], Mapping[Labels, float]]] = {}
+
+    def set_function(self, owner: str, function: Callable[[], Mapping[Labels, float]]):
+        self.functions[owner] = function
+
+    def collect(self) -> dict[Labels, float]:
+        values: dict[Labels, float] = {}
+        for function in self.functions.values():
+            values.update(function())
+        return values
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for labels, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, labels)} {value}")
+        return lines
+
+
+FRAMES = Counter("oono_frames_total", "Socket Mode frames received, by type", ["type"])
+HANDLED = Counter("oono_handled_total", "Envelopes handled, by handler", ["handler"])
+DEDUP_HITS = Counter("oono_dedup_hits_total", "Events skipped because they were already processed")
+STAGE_LATENCY = Histogram("oono_stage_seconds", "Time spent in each dispatch stage", ["stage"])
+HANDLER_LATENCY = Histogram("oono_handler_seconds", "Handler run time, by module", ["module"])
+QUEUE_WAIT = Histogram("oono_queue_wait_seconds", "Time handlers wait in executor queues, by module", ["module"])
+ACK_LATENCY = Histogram("oono_ack_latency_seconds", "Time from receiving an envelope to sending its ack", window=1000)
+LOOP_LAG = Histogram("oono_loop_lag_seconds", "How late the event loop wakes up a sleeping task", window=1000)
+LOOP_BLOCKED = Histogram("oono_loop_blocked_seconds", "Event loop stalls over the threshold, by module", ["module"])
+API_LATENCY = Histogram("oono_slack_api_seconds", "Slack Web API call latency, by method", ["method"])
+API_ERRORS = Counter("oono_slack_api_errors_total", "Slack Web API errors, by method and error", ["method", "error"])
+CACHE_REQUESTS = Counter("oono_cache_requests_total", "Cache lookups, by cache and hit or miss", ["cache", "result"])
+QUEUE_DEPTH = Gauge("oono_executor_queue_depth", "Items waiting in each executor queue", ["queue"])
+BACKGROUND_TASKS = Gauge("oono_background_tasks", "Background tasks in flight, by owner", ["owner"])
+DEDUP_TRACKER = Gauge(
+    "oono_dedup_tracker",
+    "Envelopes remembered for deduplication, by whether they were acked or are another instance's",
+    ["state"],
+)
+
+METRICS = [
+    FRAMES,
+    HANDLED,
+    DEDUP_HITS,
+    STAGE_LATENCY,
+    HANDLER_LATENCY,
+    QUEUE_WAIT,
+    ACK_LATENCY,
+    LOOP_LAG,
+    LOOP_BLOCKED,
+    API_LATENCY,
+    API_ERRORS,
+    CACHE_REQUESTS,
+    QUEUE_DEPTH,
+    BACKGROUND_TASKS,
+    DEDUP_TRACKER,
+]
+
+
+def render() -> str:
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
@@ -1,10 +1,19 @@
 from oono_akira.modules import Handler, register
-from oono_akira.admin import run_command
+from oono_akira.admin import get_parser, run_command
 from oono_akira.slack.context import SlackContext
 
 
+def warmup():
+    # Commands are imported and the parser built before the first /oono instead of during it
+    get_parser()
+
+
 @register("/oono")
 def handler(context: SlackContext, *_) -> Handler:
+    if context.must_command().text.split()[:1] == ["profile"]:
+        # Runs for up to minutes, on a queue of its own so the other commands aren't held up behind it,
+        # and so that a second profile reaches the running check instead of waiting for the first
+        return process, {"queue": f"profile/{context.id}"}
     return process, {}
 
 
@@ -1,5 +1,4 @@
 import re
-from typing import MutableSequence
 
 from oono_akira.modules import Handler, HandlerConstructorOption, register
 from oono_akira.slack.context import SlackContext
@@ -11,6 +10,28 @@ assert len(_L) == len(_R)
 
 PAREN_MAPPING = {l: r for l, r in zip(_L, _R)}
 
+RE_PAREN = re.compile(f"[{re.escape(_L + _R)}]")
+# Code spans and everything Slack wraps in angle brackets (mentions, channels, links) are matched as a whole and
+# skipped, so only the brackets in plain text reach the Python loop
+RE_TOKEN = re.compile(f"```.*?```|`[^`]*`|<[^>]*>|[{re.escape(_L + _R)}]", re.S)
+
+
+def find_unclosed(text: str) -> list[str]:
+    # Most messages have no brackets at all
+    if RE_PAREN.search(text) is None:
+        return []
+    stack: list[str] = []
+    for match in RE_TOKEN.finditer(text):
+        char = match.group()
+        if len(char) != 1:
+            continue
+        closing = PAREN_MAPPING.get(char)
+        if closing is not None:
+            stack.append(closing)
+        elif stack and stack[-1] == char:
+            stack.pop()
+    return stack
+
 
 @register("message")
 def handler(context: SlackContext, option: HandlerConstructorOption) -> Handler:
@@ -21,12 +42,7 @@ def handler(context: SlackContext, option: HandlerConstructorOption) -> Handler:
         return
     if not event.text:
         return
-    stack: MutableSequence[str] = []
-    for char in re.sub(r"<@[0-9A-Za-z]+>", "", event.text):
-        if char in PAREN_MAPPING:
-            stack.append(PAREN_MAPPING[char])
-        elif stack and stack[-1] == char:
-            stack.pop()
+    stack = find_unclosed(event.text)
     if not stack:
         return
     context.data = stack
@@ -1,48 +1,59 @@
-import asyncio
-import json
 import random
 import unicodedata
 from collections import defaultdict
 from typing import Any
 
-import aiohttp
-from oono_akira.modules import Handler, HandlerConstructorOption, register
+from oono_akira import speedups
+from oono_akira.cache import AsyncCache
+from oono_akira.modules import Handler, HandlerConstructorOption, ModuleResources, register
 from oono_akira.slack.context import SlackContext
 
 dict_data_url = "https://github.com/pwxcoo/chinese-xinhua/raw/master/data/idiom.json"
-dict_data = None
+dict_cache: AsyncCache[str, Any]
+resources: ModuleResources
 
 
-async def fetch_dict_data():
-    global dict_data
-    if dict_data is None:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(dict_data_url) as resp:
-                text = await resp.text()
-        raw = json.loads(text)
-        new_data: Any = {
-            "begin": defaultdict(list),
-            "end": defaultdict(list),
-            "mapping": {},
-            "list": [],
-        }
-        for item in raw:
-            pinyin = item["pinyin"].split()
-            pinyin = list(
-                map(
-                    lambda s: unicodedata.normalize("NFKD", s).encode("ascii", "ignore").decode(),
-                    pinyin,
-                )
+def setup(module_resources: ModuleResources):
+    global dict_cache, resources
+    dict_cache = module_resources.caches.get("idiom/dict", maxsize=1, persist=True)
+    resources = module_resources
+
+
+def build_dict_data(text: str):
+    raw = speedups.loads(text)
+    new_data: Any = {
+        "begin": defaultdict(list),
+        "end": defaultdict(list),
+        "mapping": {},
+        "list": [],
+    }
+    for item in raw:
+        pinyin = item["pinyin"].split()
+        pinyin = list(
+            map(
+                lambda s: unicodedata.normalize("NFKD", s).encode("ascii", "ignore").decode(),
+                pinyin,
             )
-            item["pinyin_normalized"] = pinyin
-            begin = pinyin[0]
-            end = pinyin[-1]
-            new_data["begin"][begin].append(item)
-            new_data["end"][end].append(item)
-            new_data["mapping"][item["word"]] = item
-            new_data["list"].append(item)
-        dict_data = new_data
-    return dict_data
+        )
+        item["pinyin_normalized"] = pinyin
+        begin = pinyin[0]
+        end = pinyin[-1]
+        new_data["begin"][begin].append(item)
+        new_data["end"][end].append(item)
+        new_data["mapping"][item["word"]] = item
+        new_data["list"].append(item)
+    return new_data
+
+
+async def load_dict_data():
+    async with resources.http.get(dict_data_url) as resp:
+        resp.raise_for_status()
+        text = await resp.text()
+    return await resources.run_in_executor(build_dict_data, text)
+
+
+async def fetch_dict_data():
+    return await dict_cache.get(dict_data_url, load_dict_data)
 
 
 @register("message")
@@ -59,7 +70,7 @@ def handler(context: SlackContext, option: HandlerConstructorOption) -> Handler:
     queue = f"{context.workspace.id}/{event.channel}"
     if not option["is_locked"]:
         if event.text == "成语接龙":
-            asyncio.create_task(fetch_dict_data())
+            resources.spawn(fetch_dict_data())
             return process, {"queue": queue, "lock": True}
     else:
         if event.text == "不玩了":
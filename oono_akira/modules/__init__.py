@@ -1,12 +1,36 @@
 import asyncio
 import importlib
+import importlib.util
 import os
 import re
+import sys
+import time
 import traceback
-from collections import OrderedDict
-from typing import Awaitable, Callable, MutableMapping, MutableSequence, Iterable, TypedDict, NotRequired
+from collections import Counter, OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from types import ModuleType
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Coroutine,
+    MutableMapping,
+    MutableSequence,
+    Iterable,
+    Mapping,
+    TypedDict,
+    TypeVar,
+    NotRequired,
+)
 
+from aiohttp import ClientSession
+
+from oono_akira.cache import CacheService
+from oono_akira.config import SandboxConfiguration
 from oono_akira.log import log
+from oono_akira.metrics import BACKGROUND_TASKS, HANDLER_LATENCY, QUEUE_DEPTH, QUEUE_WAIT
+from oono_akira.sandbox import Sandbox
 from oono_akira.slack.context import SlackContext
 
 Callback = Callable[[], Awaitable[None]]
@@ -16,17 +40,37 @@ Handler = tuple[HandlerFunction, HandlerOption] | None
 HandlerConstructorOption = TypedDict("HandlerConstructorOption", {"is_locked": bool, "has_access": bool})
 HandlerConstructor = Callable[[SlackContext, HandlerConstructorOption], Handler]
 
-ExecutorQueue = asyncio.Queue[tuple[SlackContext, HandlerFunction, Callback | None] | None]
+# The float is the time the handler was queued at
+ExecutorQueue = asyncio.Queue[tuple[SlackContext, HandlerFunction, Callback | None, float] | None]
 ExecutorTask = asyncio.Task[None]
 
+T = TypeVar("T")
+
+
+@dataclass
+class ModuleResources:
+    http: ClientSession
+    caches: CacheService
+    spawn: Callable[[Coroutine[Any, Any, Any]], asyncio.Task[Any]]
+    run_in_executor: Callable[..., Awaitable[Any]]
+
 
 class ModulesManager:
     CAPABILITIES: MutableMapping[str, MutableSequence[HandlerConstructor]] = {}
     CAPABILITIES_MAPPING: MutableMapping[str, MutableMapping[str, HandlerConstructor]] = {}
+    # Registrations of modules being reloaded, swapped in once the whole module ran
+    STAGED_CAPABILITIES: MutableMapping[str, MutableMapping[str, HandlerConstructor]] = {}
+    THREAD_POOL_SIZE = 4
+    PROCESS_POOL_SIZE = 2
+    # Seconds a reload waits for handlers of the module to finish, they keep running the old code after that
+    DRAIN_TIMEOUT = 30
 
     @staticmethod
     def register(type: str) -> Callable[[HandlerConstructor], HandlerConstructor]:
         def _register(type: str, func: HandlerConstructor):
+            if func.__module__ in ModulesManager.STAGED_CAPABILITIES:
+                ModulesManager.STAGED_CAPABILITIES[func.__module__][type] = func
+                return func
             if type not in ModulesManager.CAPABILITIES:
                 ModulesManager.CAPABILITIES[type] = []
             if func.__module__ not in ModulesManager.CAPABILITIES_MAPPING:
@@ -37,32 +81,84 @@ class ModulesManager:
 
         return lambda func: _register(type, func)
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        http: ClientSession,
+        sandbox: Mapping[str, SandboxConfiguration] | None = None,
+        only: str | None = None,
+        reload_interval: float | None = None,
+    ) -> None:
+        self._http = http
+        self._reload_interval = reload_interval
+        # Module name to options of modules whose handlers run in a worker process
+        self._sandbox_config = sandbox or {}
+        self._location = os.path.dirname(__file__)
         # Module import to module name
         self._modules_mapping: MutableMapping[str, str] = {}
-        # Module name to module import
-        modules: MutableMapping[str, str] = OrderedDict()
-        location = os.path.dirname(__file__)
-        for file in sorted(os.listdir(location)):
-            if "__" in file:
+        # Module name to loaded module
+        self._modules: MutableMapping[str, ModuleType] = OrderedDict()
+        # Module name to module import, of every module whether loaded or not
+        self._imports: MutableMapping[str, str] = OrderedDict()
+        # Module name to its file name
+        self._files: MutableMapping[str, str] = {}
+        # Capability to names of the modules registering it, in load order. Modules are imported on first use.
+        self._registry: MutableMapping[str, list[str]] = {}
+        self._resources: ModuleResources | None = None
+        eager: list[str] = []
+        for mod_name, file in self._scan().items():
+            if only is not None and mod_name != only:
                 continue
-            match = re.fullmatch(r"(_[0-9]+_([0-9a-z_]+))\.py", file)
-            if not match:
+            self._add(mod_name, file)
+            capabilities = scan_capabilities(os.path.join(self._location, file))
+            if capabilities is None or only is not None:
+                eager.append(mod_name)
                 continue
-            mod_name = match.group(2)
-            mod_import = f"oono_akira.modules.{match.group(1)}"
-            if mod_name in modules:
-                raise RuntimeError(f"duplicate module name: {mod_name}")
-            modules[mod_name] = mod_import
-        for mod_name, mod_import in modules.items():
-            mod = importlib.import_module(mod_import)
-            self._modules_mapping[mod_import] = mod_name
-            log(f"Loaded module {mod_name}, capability = {sorted(self.CAPABILITIES_MAPPING[mod.__name__])}")
-        log(f"Finished loading module at {location}")
+            for capability in capabilities:
+                self._registry.setdefault(capability, []).append(mod_name)
+        for mod_name in self._sandbox_config:
+            if mod_name not in self._imports:
+                raise RuntimeError(f"unknown sandboxed module: {mod_name}")
+            eager.append(mod_name)
+        # Modules whose capabilities can't be told from their source, and sandboxed ones, are loaded right away
+        for mod_name in eager:
+            self._load(mod_name)
+        log(f"Found {len(self._imports)} modules at {self._location}, {len(self._modules)} loaded")
 
     async def __aenter__(self):
         self._queues: MutableMapping[str, ExecutorQueue] = {}
         self._tasks: set[ExecutorTask] = set()
+        self._pending = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._background_tasks: set[asyncio.Task[Any]] = set()
+        self._thread_pool = ThreadPoolExecutor(self.THREAD_POOL_SIZE, thread_name_prefix="oono-module")
+        self._process_pool: ProcessPoolExecutor | None = None
+        QUEUE_DEPTH.set_function("modules", lambda: {(name,): queue.qsize() for name, queue in self._queues.items()})
+        BACKGROUND_TASKS.set_function("modules", lambda: {("modules",): len(self._background_tasks)})
+        self.caches = CacheService()
+        resources = ModuleResources(
+            http=self._http,
+            caches=self.caches,
+            spawn=self.spawn,
+            run_in_executor=self.run_in_executor,
+        )
+        # Constructors of sandboxed modules still run here, so every module is set up in this process too
+        self._resources = resources
+        for mod in self._modules.values():
+            if hasattr(mod, "setup"):
+                mod.setup(resources)
+        self._sandboxes = {
+            mod_name: Sandbox(mod_name, self._modules[mod_name], config)
+            for mod_name, config in self._sandbox_config.items()
+        }
+        await asyncio.gather(*(sandbox.start() for sandbox in self._sandboxes.values()))
+        # Handlers queued or running per module import, and the gates holding new ones while a module reloads
+        self._busy: Counter[str] = Counter()
+        self._drained: MutableMapping[str, asyncio.Event] = {}
+        self._reloading: MutableMapping[str, asyncio.Event] = {}
+        self._watcher: asyncio.Task[Any] | None = None
+        if self._reload_interval:
+            self._watcher = self.spawn(self._watch(self._reload_interval, self._stamps()))
         return self
 
     async def __aexit__(self, *_):
@@ -70,11 +166,275 @@ class ModulesManager:
             await queue.put(None)
         for task in list(self._tasks):
             await task
+        await asyncio.gather(*(sandbox.stop() for sandbox in self._sandboxes.values()))
+        for task in list(self._background_tasks):
+            task.cancel()
+        await asyncio.gather(*self._background_tasks, return_exceptions=True)
+        self._thread_pool.shutdown(wait=False, cancel_futures=True)
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+
+    async def drain(self, timeout: float) -> dict[str, int]:
+        # Waits for queued handlers and the tasks modules spawned, and cancels what is left at the deadline
+        deadline = time.perf_counter() + timeout
+        if self._watcher is not None:
+            self._watcher.cancel()
+        try:
+            async with asyncio.timeout(timeout):
+                await self.join()
+        except TimeoutError:
+            pass
+        queued = sum(queue.qsize() for queue in self._queues.values())
+        running = self._pending - queued
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        tasks = 0
+        if self._background_tasks:
+            _, unfinished = await asyncio.wait(
+                set(self._background_tasks), timeout=max(0, deadline - time.perf_counter())
+            )
+            for task in unfinished:
+                task.cancel()
+            tasks = len(unfinished - {self._watcher})
+        return {"handlers_queued": queued, "handlers_running": running, "module_tasks": tasks}
+
+    def module(self, name: str) -> ModuleType:
+        return self._load(name)
+
+    async def warm_up(self):
+        # Imports modules nobody used yet, then runs their warmup hooks off the loop. Imports stay on the loop,
+        # registering mutates the capability tables the loop reads, and a dispatch would block on the import lock.
+        for mod_name in list(self._imports):
+            if mod_name not in self._imports:
+                continue
+            mod = self._load(mod_name)
+            if hasattr(mod, "warmup"):
+                await asyncio.to_thread(mod.warmup)
+            # Lets envelopes that came in meanwhile through between modules
+            await asyncio.sleep(0)
+        log("Finished warming up modules")
+
+    def _load(self, mod_name: str) -> ModuleType:
+        if mod_name in self._modules:
+            return self._modules[mod_name]
+        start = time.perf_counter()
+        mod = importlib.import_module(self._imports[mod_name])
+        capabilities = sorted(self.CAPABILITIES_MAPPING.get(mod.__name__, {}))
+        order = list(self._imports)
+        for capability in capabilities:
+            if mod_name not in self._registry.setdefault(capability, []):
+                self._registry[capability].append(mod_name)
+                self._registry[capability].sort(key=order.index)
+        self._modules_mapping[mod.__name__] = mod_name
+        self._modules[mod_name] = mod
+        if self._resources is not None and hasattr(mod, "setup"):
+            mod.setup(self._resources)
+        log(
+            f"Loaded module {mod_name}, capability = {capabilities}",
+            elapsed_ms=round((time.perf_counter() - start) * 1000, 3),
+        )
+        return mod
+
+    async def reload(self, mod_name: str):
+        # Swaps in the current file of a module, or drops the module when its file is gone
+        file = self._scan().get(mod_name)
+        if mod_name in self._modules:
+            # A renamed file is imported under another name, so the module is dropped and found again
+            renamed = file is not None and file != self._files[mod_name]
+            await self._reimport(mod_name, None if renamed else file)
+            if not renamed:
+                return
+        self._rescan(mod_name, file)
+
+    def _rescan(self, mod_name: str, file: str | None):
+        # Never imported, so only the registry has to follow the file
+        if mod_name in self._imports:
+            self._unregister(mod_name)
+            self._remove(mod_name)
+        if file is None:
+            log(f"Removed module {mod_name}")
+            return
+        self._add(mod_name, file)
+        capabilities = scan_capabilities(os.path.join(self._location, file))
+        if capabilities is None:
+            self._load(mod_name)
+            return
+        order = list(self._imports)
+        for capability in capabilities:
+            self._registry.setdefault(capability, []).append(mod_name)
+            self._registry[capability].sort(key=order.index)
+        log(f"Found module {mod_name}, capability = {sorted(capabilities)}")
+
+    async def _reimport(self, mod_name: str, file: str | None):
+        start = time.perf_counter()
+        mod_import = self._imports[mod_name]
+        mod: ModuleType | None = None
+        code = None
+        if file is not None:
+            path = os.path.join(self._location, file)
+            # Compiled before anything is touched, a broken file leaves the running module alone
+            try:
+                with open(path, encoding="utf-8") as f:
+                    code = compile(f.read(), path, "exec")
+            except (OSError, SyntaxError):
+                log(f"Not reloading module {mod_name}", level="error", traceback=traceback.format_exc())
+                return
+            spec = importlib.util.spec_from_file_location(mod_import, path)
+            assert spec is not None
+            mod = importlib.util.module_from_spec(spec)
+        registered: MutableMapping[str, HandlerConstructor] = {}
+        gate = self._reloading[mod_import] = asyncio.Event()
+        try:
+            await self._drain(mod_import)
+            drained = time.perf_counter()
+            if mod is not None:
+                self.STAGED_CAPABILITIES[mod_import] = registered
+                try:
+                    exec(code, mod.__dict__)
+                finally:
+                    del self.STAGED_CAPABILITIES[mod_import]
+            self._swap(mod_name, mod, registered)
+            sandbox = self._sandboxes.pop(mod_name, None)
+            if sandbox is not None:
+                await sandbox.stop()
+                if mod is not None:
+                    self._sandboxes[mod_name] = Sandbox(mod_name, mod, self._sandbox_config[mod_name])
+                    await self._sandboxes[mod_name].start()
+        except Exception:
+            log(f"Failed to reload module {mod_name}", level="error", traceback=traceback.format_exc())
+            return
+        finally:
+            del self._reloading[mod_import]
+            gate.set()
+        # Time spent waiting for handlers, and the time the swap itself took
+        timings = {
+            "drain_ms": round((drained - start) * 1000, 3),
+            "elapsed_ms": round((time.perf_counter() - drained) * 1000, 3),
+        }
+        if mod is None:
+            log(f"Removed module {mod_name}", **timings)
+            return
+        log(f"Reloaded module {mod_name}, capability = {sorted(registered)}", **timings)
+        if hasattr(mod, "warmup"):
+            self.spawn(asyncio.to_thread(mod.warmup))
+
+    def _scan(self) -> MutableMapping[str, str]:
+        files: MutableMapping[str, str] = OrderedDict()
+        for file in sorted(os.listdir(self._location)):
+            if "__" in file:
+                continue
+            match = re.fullmatch(r"_[0-9]+_([0-9a-z_]+)\.py", file)
+            if not match:
+                continue
+            if match.group(1) in files:
+                raise RuntimeError(f"duplicate module name: {match.group(1)}")
+            files[match.group(1)] = file
+        return files
+
+    def _add(self, mod_name: str, file: str):
+        self._files[mod_name] = file
+        self._imports[mod_name] = f"oono_akira.modules.{file.removesuffix('.py')}"
+        # Kept in file order, which is the order modules get to handle an event in
+        for name in sorted(self._imports, key=self._files.__getitem__):
+            self._imports.move_to_end(name)
+
+    def _remove(self, mod_name: str):
+        del self._files[mod_name]
+        del self._imports[mod_name]
+
+    def _unregister(self, mod_name: str):
+        for capability in list(self._registry):
+            if mod_name in self._registry[capability]:
+                self._registry[capability].remove(mod_name)
+            if not self._registry[capability]:
+                del self._registry[capability]
+
+    def _swap(self, mod_name: str, mod: ModuleType | None, registered: MutableMapping[str, HandlerConstructor]):
+        # Nothing awaits in here, so an event is dispatched either entirely to the old module or to the new one
+        mod_import = self._imports[mod_name]
+        for capability in set(self.CAPABILITIES_MAPPING.pop(mod_import, {})) | set(registered):
+            handlers = [func for func in self.CAPABILITIES.get(capability, []) if func.__module__ != mod_import]
+            if capability in registered:
+                handlers.append(registered[capability])
+            self.CAPABILITIES[capability] = handlers
+        self._unregister(mod_name)
+        if mod is None:
+            del self._modules[mod_name]
+            self._remove(mod_name)
+            sys.modules.pop(mod_import, None)
+            return
+        self.CAPABILITIES_MAPPING[mod_import] = registered
+        order = list(self._imports)
+        for capability in registered:
+            self._registry.setdefault(capability, []).append(mod_name)
+            self._registry[capability].sort(key=order.index)
+        sys.modules[mod_import] = mod
+        setattr(sys.modules[__name__], mod_import.rpartition(".")[2], mod)
+        self._modules[mod_name] = mod
+        if self._resources is not None and hasattr(mod, "setup"):
+            mod.setup(self._resources)
+
+    async def _drain(self, mod_import: str):
+        if not self._busy[mod_import]:
+            return
+        drained = self._drained[mod_import] = asyncio.Event()
+        try:
+            async with asyncio.timeout(self.DRAIN_TIMEOUT):
+                await drained.wait()
+        except TimeoutError:
+            log(f"Handlers of {mod_import} still running, reloading anyway", level="warning")
+        finally:
+            del self._drained[mod_import]
+
+    def _stamps(self) -> MutableMapping[str, tuple[str, int, int]]:
+        stamps: MutableMapping[str, tuple[str, int, int]] = {}
+        for mod_name, file in self._scan().items():
+            try:
+                stat = os.stat(os.path.join(self._location, file))
+            except FileNotFoundError:
+                continue
+            stamps[mod_name] = (file, stat.st_mtime_ns, stat.st_size)
+        return stamps
+
+    async def _watch(self, interval: float, stamps: MutableMapping[str, tuple[str, int, int]]):
+        # Polling a handful of files costs microseconds, and needs nothing from the platform
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                current = self._stamps()
+            except Exception:
+                log("Failed to scan modules", level="error", traceback=traceback.format_exc())
+                continue
+            for mod_name in sorted(current.keys() | stamps.keys()):
+                if current.get(mod_name) != stamps.get(mod_name):
+                    await self.reload(mod_name)
+            stamps = current
+
+    def spawn(self, coro: Coroutine[Any, Any, Any]) -> asyncio.Task[Any]:
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_task_done)
+        return task
+
+    async def run_in_executor(self, func: Callable[..., T], *args: Any, process: bool = False) -> T:
+        # Process jobs pickle their arguments and results, so func must be a module-level function
+        executor: Executor = self._thread_pool
+        if process:
+            if self._process_pool is None:
+                self._process_pool = ProcessPoolExecutor(self.PROCESS_POOL_SIZE)
+            executor = self._process_pool
+        return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+    def _background_task_done(self, task: asyncio.Task[Any]):
+        self._background_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            log(f"Background task failed: {task.exception()!r}", level="error")
 
     def iterate_modules(self, capability: str) -> Iterable[tuple[str, HandlerConstructor]]:
-        if capability in self.CAPABILITIES:
-            for item in self.CAPABILITIES[capability]:
-                yield self._modules_mapping[item.__module__], item
+        for mod_name in self._registry.get(capability, ()):
+            mod = self._load(mod_name)
+            yield mod_name, self.CAPABILITIES_MAPPING[mod.__name__][capability]
 
     async def queue(
         self,
@@ -83,7 +443,19 @@ class ModulesManager:
         handler_func: HandlerFunction,
         callback_func: Callback | None = None,
     ):
-        await self._ensure_queue(name).put((context, handler_func, callback_func))
+        mod_import = name.partition("/")[0]
+        gate = self._reloading.get(mod_import)
+        if gate is not None:
+            # Selected by the old code, held until the swap so the drain isn't kept busy by new arrivals
+            await gate.wait()
+        self._busy[mod_import] += 1
+        self._pending += 1
+        self._idle.clear()
+        await self._ensure_queue(name).put((context, handler_func, callback_func, time.perf_counter()))
+
+    async def join(self):
+        # Wait until every queued handler has finished, including those queued while waiting
+        await self._idle.wait()
 
     def _ensure_queue(self, name: str):
         if name not in self._queues:
@@ -96,26 +468,71 @@ class ModulesManager:
         return self._queues[name]
 
     async def _run(self, name: str):
-        log(f"Executor started, name={name}")
+        log("Executor started", category="executor", queue=name)
         queue = self._queues[name]
+        module_import = name.partition("/")[0]
         while True:
             try:
                 async with asyncio.timeout(60):
                     item = await queue.get()
             except TimeoutError:
-                log(f"Executor exiting due to timeout, name={name}")
+                log("Executor exiting due to timeout", category="executor", queue=name)
                 break
             if item is None:
-                log(f"Executor exiting due to normal exit, name={name}")
+                log("Executor exiting due to normal exit", category="executor", queue=name)
                 break
-            context, handler_func, callback_func = item
+            context, handler_func, callback_func, queued = item
+            module = self._modules_mapping.get(handler_func.__module__, handler_func.__module__)
+            start = time.perf_counter()
+            QUEUE_WAIT.observe(start - queued, module)
+            context.trace.add("queue_wait", queued, start, queue=name)
+            sandbox = self._sandboxes.get(module)
             try:
-                await handler_func(context)
+                if sandbox is not None and sandbox.can_run(handler_func):
+                    await sandbox.run(context, handler_func)
+                else:
+                    await handler_func(context)
                 if callback_func:
                     await callback_func()
             except Exception:
-                traceback.print_exc()
+                log(
+                    "Handler failed",
+                    level="error",
+                    category="handler",
+                    module=module,
+                    envelope=context.id,
+                    traceback=traceback.format_exc(),
+                )
+            finally:
+                end = time.perf_counter()
+                HANDLER_LATENCY.observe(end - start, module)
+                context.trace.add("handler", start, end, module=module)
+                context.trace.finish()
+                self._busy[module_import] -= 1
+                if not self._busy[module_import] and module_import in self._drained:
+                    self._drained[module_import].set()
+                self._pending -= 1
+                if self._pending == 0:
+                    self._idle.set()
         del self._queues[name]
 
 
+REGISTER_DECORATOR = re.compile(r"^[ \t]*@(?:\w+\.)*register\((.*)\)[ \t]*$", re.MULTILINE)
+REGISTER_LITERAL = re.compile(r"""\s*(?:"([^"\\]*)"|'([^'\\]*)')\s*""")
+
+
+def scan_capabilities(path: str) -> list[str] | None:
+    # Capabilities a module registers, read from its source without running it, None when they can't be told.
+    # A plain text match, an ast walk costs more than importing a small module.
+    with open(path, encoding="utf-8") as f:
+        source = f.read()
+    capabilities: list[str] = []
+    for match in REGISTER_DECORATOR.finditer(source):
+        literal = REGISTER_LITERAL.fullmatch(match.group(1))
+        if literal is None:
+            return None
+        capabilities.append(literal.group(1) if literal.group(1) is not None else literal.group(2))
+    return capabilities
+
+
 register = ModulesManager.register
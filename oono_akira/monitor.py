@@ -0,0 +1,89 @@
+import asyncio
+import os
+import re
+import sys
+import threading
+import time
+from types import FrameType
+
+from oono_akira.log import log
+from oono_akira.metrics import LOOP_BLOCKED, LOOP_LAG
+
+MODULE_NAME = re.compile(r"oono_akira\.modules\._[0-9]+_([0-9a-z_]+)")
+
+
+def blame(frame: FrameType | None) -> tuple[str, str]:
+    # The innermost module frame is the culprit, or the innermost frame of our own code when there's none
+    location = ""
+    owner = ""
+    while frame is not None:
+        name = frame.f_globals.get("__name__", "")
+        if not location:
+            location = f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})"
+        match = MODULE_NAME.match(name)
+        if match:
+            return match.group(1), location
+        if not owner and name.startswith("oono_akira."):
+            owner = name
+        frame = frame.f_back
+    return owner or "unknown", location
+
+
+class LoopMonitor:
+    """Samples event loop lag, and blames whatever blocks the loop for longer than the threshold."""
+
+    INTERVAL = 0.05
+
+    def __init__(self, threshold: float):
+        self._threshold = threshold
+        self._heartbeat = 0.0
+        # Set by the watchdog thread while the loop is blocked, reported by the loop once it's back
+        self._culprit: tuple[float, str, str] | None = None
+        self._stop = threading.Event()
+
+    async def __aenter__(self):
+        self._heartbeat = time.perf_counter()
+        self._ticker = asyncio.create_task(self._tick())
+        self._watchdog = threading.Thread(
+            target=self._watch, args=(threading.get_ident(),), name="oono-watchdog", daemon=True
+        )
+        self._watchdog.start()
+        return self
+
+    async def __aexit__(self, *_):
+        self._stop.set()
+        self._ticker.cancel()
+        await asyncio.gather(self._ticker, return_exceptions=True)
+        self._watchdog.join()
+
+    async def _tick(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.INTERVAL)
+            self._heartbeat = now = time.perf_counter()
+            lag = max(now - start - self.INTERVAL, 0.0)
+            LOOP_LAG.observe(lag)
+            culprit, self._culprit = self._culprit, None
+            if lag < self._threshold:
+                continue
+            # Lag without a culprit is many short callbacks rather than one long one
+            module, location = culprit[1:] if culprit is not None else ("unknown", "")
+            LOOP_BLOCKED.observe(lag, module)
+            log(
+                "Event loop blocked",
+                level="warning",
+                category="loop",
+                lag_ms=round(lag * 1000, 1),
+                module=module,
+                location=location,
+            )
+
+    def _watch(self, thread_id: int):
+        while not self._stop.wait(self.INTERVAL / 5):
+            heartbeat = self._heartbeat
+            if time.perf_counter() - heartbeat - self.INTERVAL < self._threshold:
+                continue
+            # Only look once per blocked interval, the stack doesn't change while the loop is stuck
+            if self._culprit is not None and self._culprit[0] == heartbeat:
+                continue
+            self._culprit = (heartbeat, *blame(sys._current_frames().get(thread_id)))
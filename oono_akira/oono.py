@@ -1,26 +1,58 @@
 import asyncio
-import json
 import ssl
 import time
 import traceback
-from collections import deque
-from contextlib import AsyncExitStack
-from typing import Any, MutableMapping, Coroutine
+from collections import OrderedDict
+from contextlib import AbstractAsyncContextManager, AsyncExitStack
+from typing import Any, Coroutine
+from urllib.parse import parse_qsl
 
-from aiohttp import ClientSession, web, WSMsgType
+from aiohttp import ClientSession, ClientWebSocketResponse, TCPConnector, web, WSMsgType
 from aiohttp.web_request import Request
 
-from oono_akira.config import Configuration
+from oono_akira import speedups
+from oono_akira.archive import PayloadArchive
+from oono_akira.config import Configuration, SnapshotConfiguration
 from oono_akira.db import OonoDatabase
+from oono_akira.dedup import DedupStore
 from oono_akira.log import log
-from oono_akira.modules import ModulesManager
+from oono_akira.metrics import (
+    ACK_LATENCY,
+    BACKGROUND_TASKS,
+    DEDUP_HITS,
+    DEDUP_TRACKER,
+    FRAMES,
+    HANDLED,
+    STAGE_LATENCY,
+    render,
+)
+from oono_akira.modules import Callback, HandlerFunction, HandlerOption, ModulesManager
+from oono_akira.monitor import LoopMonitor
 from oono_akira.slack.context import SlackContext
-from oono_akira.slack.recv import SlackPayloadParser, SlackEventsApiPayload, SlackSlashCommandsPayload
+from oono_akira.slack.recv import (
+    SlackPayloadParser,
+    SlackEventsApiPayload,
+    SlackSlashCommandsPayload,
+    SlackWebSocketEventPayload,
+)
 from oono_akira.slack.send import SlackAPI
+from oono_akira.slack.verify import verify_request
+from oono_akira.snapshot import load_snapshot, save_snapshot
+from oono_akira.trace import Trace, Tracer
 
 
 class OonoAkira:
-    PAYLOAD_TRACKER_SIZE = 1024
+    HTTP_LIMIT = 100
+    HTTP_LIMIT_PER_HOST = 32
+    LOOP_BLOCKED_THRESHOLD = 0.1
+    # Matches the default dedup TTL, older dedup entries would have expired anyway
+    SNAPSHOT_MAX_AGE = 600
+    # Slack wants an answer in 3 seconds, reply with an empty ack before that if the handler hasn't
+    HTTP_ACK_TIMEOUT = 2.5
+    # HTTP envelopes answered without their handler's ack, remembered so a late ack is dropped
+    HTTP_LATE_ACKS = 10000
+    # Slack redelivers what isn't acked, so handlers get a while to finish before they are handed back
+    DRAIN_TIMEOUT = 20
 
     def __init__(self, config: Configuration):
         slack = config["slack"]
@@ -31,51 +63,230 @@ class OonoAkira:
         }
         self._slack_app_token = slack["token"]
         self._slack_permissions = slack["permissions"]
+        self._slack_api_url = slack.get("api_url", "https://slack.com/api")
+        self._slack_signing_secret = slack.get("signing_secret")
+        # "socket" receives over Socket Mode, "http" only over the Events API routes
+        self._slack_mode = slack.get("mode", "socket")
 
         self._db_config = config["database"]
+        self._sandbox_config = config.get("sandbox")
+        self._modules_config = config.get("modules", {})
+        self._archive_config = config.get("archive")
+        self._archive: PayloadArchive | None = None
+        self._snapshot_config = config.get("snapshot")
 
         server = config["server"]
-        if "ssl" in server:
-            self._ssl_context = ssl.SSLContext()
-            self._ssl_context.load_cert_chain(server["ssl"]["cert"], server["ssl"]["key"])
-        else:
-            self._ssl_context = None
+        self._ssl_config = server.get("ssl")
         self._web_app = web.Application()
         self._web_app.add_routes([web.get(f"{server.get('prefix', '')}/oauth", self._oauth_handler)])
         self._web_app.add_routes([web.get(f"{server.get('prefix', '')}/install", self._install_handler)])
+        self._web_app.add_routes([web.get(f"{server.get('prefix', '')}/metrics", self._metrics_handler)])
+        if self._slack_signing_secret is not None:
+            self._web_app.add_routes([web.post(f"{server.get('prefix', '')}/slack/events", self._events_handler)])
+            self._web_app.add_routes([web.post(f"{server.get('prefix', '')}/slack/commands", self._commands_handler)])
+        elif self._slack_mode == "http":
+            raise RuntimeError("signing_secret is required to receive events over HTTP")
         self._web_port = server.get("port", 25472)
 
-        self._payload_tracker: MutableMapping[str, str] = dict()
-        self._payload_tracker_queue: deque[str] = deque()
+        self._dedup = DedupStore(config.get("dedup"))
 
         self._background_tasks: set[asyncio.Task[Any]] = set()
+        # Envelopes received over HTTP, acked by resolving the future their request waits on
+        self._http_acks: dict[str, asyncio.Future[tuple[Any, Trace]]] = {}
+        self._http_late: OrderedDict[str, None] = OrderedDict()
 
-    async def __aenter__(self):
-        self._ack_queue: asyncio.Queue[tuple[str, Any]] = asyncio.Queue()
+        self._tracer = Tracer(config["tracing"]) if "tracing" in config else None
 
+        self._drain_timeout = config.get("runtime", {}).get("drain_timeout", self.DRAIN_TIMEOUT)
+        self._draining = asyncio.Event()
+        self._drain_deadline: float | None = None
+        self._drained = False
+
+    async def __aenter__(self):
+        self._started = time.perf_counter()
+        self._first_ack: float | None = None
+        # Envelope ID, ack payload and the trace started when the envelope was received
+        self._ack_queue: asyncio.Queue[tuple[str, Any, Trace]] = asyncio.Queue()
+        BACKGROUND_TASKS.set_function("core", lambda: {("core",): len(self._background_tasks)})
+        DEDUP_TRACKER.set_function("core", lambda: {(state,): count for state, count in self._dedup.counts().items()})
+
+        timings: dict[str, float] = {}
         async with AsyncExitStack() as stack:
-            self._db = await stack.enter_async_context(OonoDatabase(self._db_config))
-            self._client = await stack.enter_async_context(ClientSession())
-            self._modules = await stack.enter_async_context(ModulesManager())
+            await stack.enter_async_context(LoopMonitor(self.LOOP_BLOCKED_THRESHOLD))
+            self._client = await stack.enter_async_context(
+                ClientSession(
+                    connector=TCPConnector(limit=self.HTTP_LIMIT, limit_per_host=self.HTTP_LIMIT_PER_HOST),
+                    json_serialize=speedups.dumps,
+                )
+            )
+            start = time.perf_counter()
+            self._modules = ModulesManager(
+                self._client, self._sandbox_config, reload_interval=self._modules_config.get("reload_interval")
+            )
+            timings["modules_scan"] = time.perf_counter() - start
+            self._db = OonoDatabase(self._db_config)
+            # None of these depend on each other, and the database engine and sandbox workers take a while to start
+            await self._enter_concurrently(
+                stack, timings, dedup=self._dedup, database=self._db, modules_setup=self._modules
+            )
+            if self._archive_config is not None:
+                self._archive = await stack.enter_async_context(PayloadArchive(self._archive_config, self._db))
             self._stack = stack.pop_all()
 
-        # server
+        if self._snapshot_config is not None:
+            start = time.perf_counter()
+            await self._restore_snapshot(self._snapshot_config)
+            timings["snapshot"] = time.perf_counter() - start
+        start = time.perf_counter()
+        await self._start_server()
+        timings["server"] = time.perf_counter() - start
+        # Modules are imported on first use, this gets the rest of them ready before they are needed
+        self._warm_up = self._run_in_background(self._modules.warm_up())
+
+        log(
+            "Started",
+            total_ms=round((time.perf_counter() - self._started) * 1000, 3),
+            **{f"{name}_ms": round(elapsed * 1000, 3) for name, elapsed in timings.items()},
+        )
+        return self
+
+    @staticmethod
+    async def _enter_concurrently(
+        stack: AsyncExitStack, timings: dict[str, float], **contexts: AbstractAsyncContextManager[Any]
+    ):
+        async def enter(name: str, context: AbstractAsyncContextManager[Any]):
+            start = time.perf_counter()
+            try:
+                return await context.__aenter__()
+            finally:
+                timings[name] = time.perf_counter() - start
+
+        results = await asyncio.gather(
+            *(enter(name, context) for name, context in contexts.items()), return_exceptions=True
+        )
+        # Only those that entered are exited, in reverse order like everything else on the stack
+        for context, result in zip(contexts.values(), results):
+            if not isinstance(result, BaseException):
+                stack.push_async_exit(context)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    async def __aexit__(self, *_):
+        # Without a stop, like when run() failed, there's no connection left to ack over
+        if not self._drained:
+            self.stop()
+            await self._drain(flush_acks=False)
+        await self._stop_server()
+        await self._stack.aclose()
+        # Taken after handlers have drained, so everything they acked is in it
+        if self._snapshot_config is not None:
+            await self._save_snapshot(self._snapshot_config)
+        if self._tracer is not None:
+            self._tracer.close()
+
+    def stop(self):
+        # Stops taking envelopes, and makes run() return once what was taken is finished or handed back
+        if self._drain_deadline is None:
+            log(f"Stopping, draining for up to {self._drain_timeout} seconds")
+            self._drain_deadline = time.perf_counter() + self._drain_timeout
+            self._draining.set()
+
+    def _remaining(self) -> float:
+        assert self._drain_deadline is not None
+        return max(0, self._drain_deadline - time.perf_counter())
+
+    async def _drain(self, flush_acks: bool = True):
+        # Handlers first, then the acks they queued, then the sends and writes in the background
+        start = time.perf_counter()
+        self._drained = True
+        self._warm_up.cancel()
+        report = await self._drain_handlers()
+        if flush_acks:
+            try:
+                async with asyncio.timeout(self._remaining()):
+                    await self._ack_queue.join()
+            except TimeoutError:
+                pass
+        if self._slack_mode != "http":
+            report["acks"] = self._ack_queue.qsize()
+        background = self._background_tasks - {self._warm_up}
+        report["background"] = 0
+        if background:
+            _, unfinished = await asyncio.wait(background, timeout=self._remaining())
+            for task in unfinished:
+                task.cancel()
+            report["background"] = len(unfinished)
+        # Requests over HTTP still waiting get a 503, and Slack retries them elsewhere
+        for future in self._http_acks.values():
+            if not future.done():
+                future.set_exception(web.HTTPServiceUnavailable())
+        handed_off = self._dedup.release_inflight()
+        # Handlers cut short whose envelope wasn't acked yet are among those handed off
+        log(
+            "Drained",
+            level="warning" if any(report.values()) else "info",
+            handed_off=handed_off,
+            elapsed_ms=round((time.perf_counter() - start) * 1000, 3),
+            **report,
+        )
+
+    async def _drain_handlers(self) -> dict[str, int]:
+        return await self._modules.drain(self._remaining())
+
+    async def _restore_snapshot(self, config: SnapshotConfiguration):
+        start = time.perf_counter()
+        max_age = config.get("max_age", self.SNAPSHOT_MAX_AGE)
+        state = await asyncio.get_running_loop().run_in_executor(None, load_snapshot, config["path"], max_age)
+        if state is None:
+            return
+        self._dedup.restore(state["dedup"])
+        self._modules.caches.restore(state["caches"])
+        log(
+            "Restored snapshot",
+            path=config["path"],
+            dedup=len(state["dedup"]),
+            caches=",".join(state["caches"]),
+            elapsed_ms=round((time.perf_counter() - start) * 1000, 3),
+        )
+
+    async def _save_snapshot(self, config: SnapshotConfiguration):
+        start = time.perf_counter()
+        state = {"dedup": self._dedup.dump(), "caches": self._modules.caches.dump()}
+        try:
+            size = await asyncio.get_running_loop().run_in_executor(None, save_snapshot, config["path"], state)
+        except Exception:
+            log("Failed to write snapshot", level="error", traceback=traceback.format_exc())
+            return
+        log(
+            "Wrote snapshot",
+            path=config["path"],
+            bytes=size,
+            elapsed_ms=round((time.perf_counter() - start) * 1000, 3),
+        )
+
+    async def _start_server(self):
+        if self._ssl_config is not None:
+            ssl_context = ssl.SSLContext()
+            ssl_context.load_cert_chain(self._ssl_config["cert"], self._ssl_config["key"])
+        else:
+            ssl_context = None
         self._web_runner = web.AppRunner(self._web_app)
         await self._web_runner.setup()
-        self._web_site = web.TCPSite(self._web_runner, port=self._web_port, ssl_context=self._ssl_context)
+        self._web_site = web.TCPSite(self._web_runner, port=self._web_port, ssl_context=ssl_context)
         await self._web_site.start()
         log(f"Listening on port {self._web_port}")
 
-        return self
-
-    async def __aexit__(self, *_):
+    async def _stop_server(self):
         await self._web_site.stop()
         await self._web_runner.cleanup()
-        await self._stack.aclose()
+
+    def _api(self, token: str | None = None, trace: Trace | None = None) -> SlackAPI:
+        return SlackAPI(self._client, token, url=self._slack_api_url, trace=trace)
 
     async def _oauth_handler(self, request: Request):
         code = request.rel_url.query["code"]
-        auth_resp = await SlackAPI(self._client).oauth.v2.access(code=code, **self._slack_oauth)
+        auth_resp = await self._api().oauth.v2.access(code=code, **self._slack_oauth)
         if not auth_resp["ok"]:
             return web.Response(text=auth_resp["error"])
         await self._db.setup_workspace(
@@ -88,7 +299,7 @@ class OonoAkira:
         )
         self._run_in_background(self._db.record_payload("oauth", auth_resp))
         log(f"App is installed in workspace {auth_resp['team']['name']}, id = {auth_resp['team']['id']}")
-        test_resp = await SlackAPI(self._client, token=auth_resp["access_token"]).auth.test()
+        test_resp = await self._api(auth_resp["access_token"]).auth.test()
         return web.HTTPFound(test_resp["url"])
 
     async def _install_handler(self, _: Request):
@@ -99,109 +310,276 @@ class OonoAkira:
         )
         raise web.HTTPFound(auth_uri)
 
-    def _run_in_background(self, coro: Coroutine[Any, Any, Any]):
+    async def _metrics_handler(self, _: Request):
+        return web.Response(text=render(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    async def _events_handler(self, request: Request):
+        received = time.perf_counter()
+        if self._draining.is_set():
+            raise web.HTTPServiceUnavailable()
+        body = await request.read()
+        self._verify(request, body)
+        data = speedups.loads(body)
+        if data.get("type") == "url_verification":
+            return web.json_response({"challenge": data["challenge"]})
+        if data.get("type") != "event_callback":
+            return web.Response()
+        # Retries carry the same event ID, and each of them waits for its own ack
+        envelope_id = f"http-{data['event_id']}-{request.headers.get('X-Slack-Retry-Num', '0')}"
+        return await self._receive_http({"type": "events_api", "envelope_id": envelope_id, "payload": data}, received)
+
+    async def _commands_handler(self, request: Request):
+        received = time.perf_counter()
+        if self._draining.is_set():
+            raise web.HTTPServiceUnavailable()
+        body = await request.read()
+        self._verify(request, body)
+        data = dict(parse_qsl(body.decode()))
+        envelope_id = f"http-{data.get('trigger_id') or id(request)}"
+        return await self._receive_http(
+            {"type": "slash_commands", "envelope_id": envelope_id, "payload": data}, received
+        )
+
+    def _verify(self, request: Request, body: bytes):
+        assert self._slack_signing_secret is not None
+        timestamp = request.headers.get("X-Slack-Request-Timestamp")
+        signature = request.headers.get("X-Slack-Signature")
+        if not verify_request(self._slack_signing_secret, timestamp, signature, body):
+            raise web.HTTPUnauthorized()
+
+    async def _receive_http(self, frame: Any, received: float):
+        envelope_id = frame["envelope_id"]
+        if envelope_id in self._http_acks:
+            # The same delivery twice at once, the first request answers for it
+            DEDUP_HITS.inc()
+            return web.Response()
+        future = self._http_acks[envelope_id] = asyncio.get_running_loop().create_future()
+        trace: Trace | None = None
+        try:
+            # Shaped like a Socket Mode frame, so that it's recorded, replayed and sharded like one
+            await self._process_frame(speedups.dumps(frame), received, "http")
+            async with asyncio.timeout(self.HTTP_ACK_TIMEOUT):
+                body, trace = await future
+        except TimeoutError:
+            log("Handler did not ack in time, sending an empty ack", level="warning", envelope=envelope_id)
+            body = None
+        finally:
+            if not self._http_acks.pop(envelope_id).done():
+                # Its request is answered, there's nowhere left for the ack to go
+                self._http_late[envelope_id] = None
+                if len(self._http_late) > self.HTTP_LATE_ACKS:
+                    self._http_late.popitem(last=False)
+        end = time.perf_counter()
+        self._acked(received, end)
+        if trace is not None:
+            trace.add("ack", received, end)
+        if body is None:
+            return web.Response()
+        return web.json_response(body, dumps=speedups.dumps)
+
+    def _run_in_background(self, coro: Coroutine[Any, Any, Any]) -> asyncio.Task[Any]:
         task = asyncio.create_task(coro)
         self._background_tasks.add(task)
         task.add_done_callback(self._background_tasks.discard)
+        return task
 
     async def run(self):
-        while True:
+        if self._slack_mode == "http":
+            log("Receiving events over HTTP")
+            await self._draining.wait()
+            await self._drain(flush_acks=False)
+            return
+        while not self._draining.is_set():
             try:
                 log("Trying to establish connection")
                 conn_resp = await self._client.post(
-                    "https://slack.com/api/apps.connections.open",
+                    f"{self._slack_api_url}/apps.connections.open",
                     headers={"Authorization": f"Bearer {self._slack_app_token}"},
                 )
                 if not conn_resp.ok:
-                    log("Failed to request connections.open, retrying...")
-                    time.sleep(5)
+                    log("Failed to request connections.open, retrying...", level="warning")
+                    await self._sleep_unless_draining(5)
                     continue
 
-                conn_url = await conn_resp.json()
+                conn_url = await conn_resp.json(loads=speedups.loads)
                 if not conn_url["ok"]:
-                    log(f"connections.open() returned error: {conn_url['error']}, retrying...")
-                    time.sleep(5)
+                    log(f"connections.open() returned error: {conn_url['error']}, retrying...", level="warning")
+                    await self._sleep_unless_draining(5)
                     continue
 
                 async with self._client.ws_connect(conn_url["url"]) as conn:
-                    recv = asyncio.create_task(conn.receive())
-                    ack = asyncio.create_task(self._ack_queue.get())
-                    pending = {recv, ack}
-                    while True:
-                        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
-                        if recv in done:
+                    acks = asyncio.create_task(self._pump_acks(conn))
+                    draining = asyncio.create_task(self._draining.wait())
+                    try:
+                        while True:
+                            recv = asyncio.create_task(conn.receive())
+                            await asyncio.wait((recv, draining), return_when=asyncio.FIRST_COMPLETED)
+                            if draining.done():
+                                # Frames not read from here on are never acked, and Slack sends them elsewhere
+                                recv.cancel()
+                                await self._drain()
+                                await conn.close()
+                                break
                             # Receive data
                             recv_result = await recv
+                            received = time.perf_counter()
                             if recv_result.type == WSMsgType.ERROR:
-                                log(f"Websocket returned error: {recv_result}")
+                                log(f"Websocket returned error: {recv_result}", level="warning")
                                 break
-                            self._run_in_background(self._db.record_payload("websocket", recv_result.data))
-                            # Start a new recv task
-                            recv = asyncio.create_task(conn.receive())
-                            pending.add(recv)
                             # Process payload
-                            payload = SlackPayloadParser.parse(json.loads(recv_result.data))
-                            if payload.type == "hello":
-                                assert payload.connection_info is not None
-                                log(f"WebSocket connection established, appid = {payload.connection_info['app_id']}")
-                            elif payload.type == "disconnect":
-                                assert payload.reason is not None
-                                log(f"Received disconnect request, reason: {payload.reason}")
+                            if not await self._process_frame(recv_result.data, received):
                                 await conn.close()
                                 break
-                            elif payload.type == "events_api":
-                                assert payload.envelope_id is not None
-                                assert isinstance(payload.payload, SlackEventsApiPayload)
-                                envelope_id = payload.envelope_id
-                                event_id = payload.payload.event_id
-                                track = self._track_payload(event_id, "unknown")
-                                if track is None:
-                                    handler_name = await self._process_event(envelope_id, payload.payload)
-                                    self._track_payload(event_id, handler_name, update=True)
-                                    log(f"Handled event {event_id}, handler={handler_name}")
-                                else:
-                                    log(f"Duplicate event {event_id}. Previously processed by {track}.")
-                            elif payload.type == "slash_commands":
-                                assert payload.envelope_id is not None
-                                assert isinstance(payload.payload, SlackSlashCommandsPayload)
-                                envelope_id = payload.envelope_id
-                                handler_name = await self._process_command(envelope_id, payload.payload)
-                                log(f"Handled command {payload.payload.command}, handler={handler_name}")
-                        if ack in done:
-                            # Start a new ack task
-                            ack_result = await ack
-                            ack = asyncio.create_task(self._ack_queue.get())
-                            pending.add(ack)
-                            # Process ack
-                            envelope_id, payload = ack_result
-                            self._run_in_background(conn.send_json({"envelope_id": envelope_id, "payload": payload}))
+                    finally:
+                        acks.cancel()
+                        draining.cancel()
                 log(f"Disconnected.")
 
             except Exception:
-                traceback.print_exc()
+                log("Connection failed", level="error", traceback=traceback.format_exc())
 
-    def _track_payload(self, track_id: str, processor: str, *, update: bool = False) -> str | None:
-        # When update is True, we should never add new values to tracker
-        if update:
-            if track_id in self._payload_tracker:
-                self._payload_tracker[track_id] = processor
-            return
-        # The payload is already tracked, so return the value
-        if track_id in self._payload_tracker:
-            return self._payload_tracker[track_id]
-        # Otherwise, we add a record
-        self._payload_tracker_queue.append(track_id)
-        self._payload_tracker[track_id] = processor
-        if len(self._payload_tracker_queue) > self.PAYLOAD_TRACKER_SIZE:
-            item = self._payload_tracker_queue.popleft()
-            del self._payload_tracker[item]
-        return
-
-    async def _process_event(self, envelope_id: str, payload: SlackEventsApiPayload) -> str:
+    async def _sleep_unless_draining(self, delay: float):
+        try:
+            async with asyncio.timeout(delay):
+                await self._draining.wait()
+        except TimeoutError:
+            pass
+
+    async def _pump_acks(self, conn: ClientWebSocketResponse):
+        # Acks left in the queue when the connection drops go out over the next one
+        while True:
+            ack = await self._ack_queue.get()
+            self._run_in_background(self._send_ack(conn, *ack))
+            self._ack_queue.task_done()
+
+    async def _send_ack(self, conn: ClientWebSocketResponse, envelope_id: str, payload: Any, trace: Trace):
+        start = time.perf_counter()
+        await conn.send_json({"envelope_id": envelope_id, "payload": payload}, dumps=speedups.dumps)
+        end = self._stage(trace, "ack_send", start)
+        self._acked(trace.start, end)
+        trace.add("ack", trace.start, end)
+
+    def _acked(self, received: float, end: float):
+        ACK_LATENCY.observe(end - received)
+        if self._first_ack is None:
+            self._first_ack = end
+            log("First ack sent", since_startup_ms=round((end - self._started) * 1000, 3))
+
+    @staticmethod
+    def _stage(trace: Trace, name: str, start: float) -> float:
+        end = time.perf_counter()
+        STAGE_LATENCY.observe(end - start, name)
+        trace.add(name, start, end)
+        return end
+
+    def _record(self, source: str, content: str | Any, frame: Any):
+        if self._archive is None or self._archive.sampled(frame):
+            self._run_in_background(self._db.record_payload(source, content))
+
+    def _new_trace(self, received: float) -> Trace:
+        return self._tracer.trace(received) if self._tracer is not None else Trace(None, received)
+
+    async def _ack(self, envelope_id: str, body: Any, trace: Trace):
+        future = self._http_acks.get(envelope_id)
+        if future is None:
+            if envelope_id in self._http_late:
+                del self._http_late[envelope_id]
+                log("Dropping an ack after its HTTP request was answered", level="warning", envelope=envelope_id)
+                return
+            await self._ack_queue.put((envelope_id, body, trace))
+        elif not future.done():
+            future.set_result((body, trace))
+
+    async def _process_frame(self, data: str, received: float | None = None, source: str = "websocket") -> bool:
+        # Returns False when Slack asks us to disconnect
+        if received is None:
+            received = time.perf_counter()
+        trace = self._new_trace(received)
+        frame = speedups.loads(data)
+        self._record(source, data, frame)
+        payload = SlackPayloadParser.parse(frame)
+        self._stage(trace, "parse", received)
+        FRAMES.inc(payload.type)
+        return await self._dispatch_frame(payload, trace)
+
+    async def _dispatch_frame(self, payload: SlackWebSocketEventPayload, trace: Trace) -> bool:
+        if payload.type == "hello":
+            assert payload.connection_info is not None
+            log(f"WebSocket connection established, appid = {payload.connection_info['app_id']}")
+        elif payload.type == "disconnect":
+            assert payload.reason is not None
+            log(f"Received disconnect request, reason: {payload.reason}")
+            return False
+        elif payload.type == "events_api":
+            assert payload.envelope_id is not None
+            assert isinstance(payload.payload, SlackEventsApiPayload)
+            envelope_id = payload.envelope_id
+            event_id = payload.payload.event_id
+            track = await self._dedup.claim(event_id)
+            if track is None:
+                trace.name = f"{payload.payload.event.type} {event_id}"
+                try:
+                    handler_name = await self._process_event(envelope_id, payload.payload, trace)
+                except Exception:
+                    self._dedup.release(event_id)
+                    raise
+                self._dedup.update(event_id, handler_name)
+                HANDLED.inc(handler_name)
+                trace.finish()
+                log(
+                    "Handled event",
+                    category="event",
+                    event=event_id,
+                    handler=handler_name,
+                    workspace=payload.payload.team_id,
+                    channel=payload.payload.event.channel,
+                    envelope=envelope_id,
+                    latency_ms=round((time.perf_counter() - trace.start) * 1000, 3),
+                )
+            else:
+                DEDUP_HITS.inc()
+                log("Duplicate event", category="event", event=event_id, handler=track, envelope=envelope_id)
+                await self._ack(envelope_id, None, trace)
+        elif payload.type == "slash_commands":
+            assert payload.envelope_id is not None
+            assert isinstance(payload.payload, SlackSlashCommandsPayload)
+            envelope_id = payload.envelope_id
+            # Commands have no ID of their own, but a redelivered envelope keeps its ID
+            track = await self._dedup.claim(f"command/{envelope_id}")
+            if track is not None:
+                DEDUP_HITS.inc()
+                log("Duplicate command", category="command", handler=track, envelope=envelope_id)
+                await self._ack(envelope_id, None, trace)
+                return True
+            trace.name = f"{payload.payload.command} {envelope_id}"
+            try:
+                handler_name = await self._process_command(envelope_id, payload.payload, trace)
+            except Exception:
+                self._dedup.release(f"command/{envelope_id}")
+                raise
+            self._dedup.update(f"command/{envelope_id}", handler_name)
+            HANDLED.inc(handler_name)
+            trace.finish()
+            log(
+                "Handled command",
+                category="command",
+                command=payload.payload.command,
+                handler=handler_name,
+                workspace=payload.payload.team_id,
+                channel=payload.payload.channel_id,
+                envelope=envelope_id,
+                latency_ms=round((time.perf_counter() - trace.start) * 1000, 3),
+            )
+        return True
+
+    async def _process_event(self, envelope_id: str, payload: SlackEventsApiPayload, trace: Trace) -> str:
         async def ack(body: Any = None):
-            return await self._ack_queue.put((envelope_id, body))
+            self._dedup.finish(payload.event_id)
+            return await self._ack(envelope_id, body, trace)
 
+        start = time.perf_counter()
         workspace = await self._db.get_workspace(payload.team_id)
+        self._stage(trace, "db_workspace", start)
         if workspace is None:
             await ack()
             return "unknown_workspace"
@@ -214,17 +592,20 @@ class OonoAkira:
 
         context = SlackContext(
             id=envelope_id,
-            api=SlackAPI(self._client, workspace.token),
+            api=self._api(workspace.token, trace),
             db=self._db,
             ack=ack,
             workspace=workspace,
             event=payload.event,
+            trace=trace,
         )
 
+        start = time.perf_counter()
         locks, accesses = await asyncio.gather(
             self._db.get_locks(workspace.id, payload.event.channel),
             self._db.get_accesses(workspace.id, payload.event.channel, payload.event.user),
         )
+        selecting = self._stage(trace, "db_access", start)
         for module, constructor in self._modules.iterate_modules(payload.event.type):
             if locks and module not in locks:
                 continue
@@ -232,8 +613,12 @@ class OonoAkira:
             if handler is not None:
                 break
         else:
+            self._stage(trace, "select", selecting)
             await ack()
             return "no_handler"
+        self._stage(trace, "select", selecting)
+
+        option = handler[1]
 
         async def callback():
             if "lock" in option:
@@ -242,44 +627,55 @@ class OonoAkira:
                 else:
                     await self._db.release_lock(workspace.id, payload.event.channel, module)
 
-        handler_func, option = handler
-        queue_name = f"{handler_func.__module__}/{option.get('queue', '__default__')}"
-        await self._modules.queue(queue_name, context, handler_func, callback)
-
-        return handler_func.__module__
+        return await self._queue_handler(context, handler, callback)
 
-    async def _process_command(self, envelope_id: str, payload: SlackSlashCommandsPayload) -> str:
+    async def _process_command(self, envelope_id: str, payload: SlackSlashCommandsPayload, trace: Trace) -> str:
         async def ack(body: Any = None):
-            return await self._ack_queue.put((envelope_id, body))
+            self._dedup.finish(f"command/{envelope_id}")
+            return await self._ack(envelope_id, body, trace)
 
+        start = time.perf_counter()
         workspace = await self._db.get_workspace(payload.team_id)
+        self._stage(trace, "db_workspace", start)
         if workspace is None:
             await ack()
             return "unknown_workspace"
 
         context = SlackContext(
             id=envelope_id,
-            api=SlackAPI(self._client, workspace.token),
+            api=self._api(workspace.token, trace),
             db=self._db,
             ack=ack,
             workspace=workspace,
             command=payload,
+            trace=trace,
         )
 
+        start = time.perf_counter()
         locks, accesses = await asyncio.gather(
             self._db.get_locks(workspace.id, payload.channel_id),
             self._db.get_accesses(workspace.id, payload.channel_id, payload.user_id),
         )
+        selecting = self._stage(trace, "db_access", start)
         for module, constructor in self._modules.iterate_modules(payload.command):
             handler = constructor(context, {"is_locked": module in locks, "has_access": module in accesses})
             if handler is not None:
                 break
         else:
+            self._stage(trace, "select", selecting)
             await ack()
             return "no_handler"
+        self._stage(trace, "select", selecting)
 
+        return await self._queue_handler(context, handler)
+
+    async def _queue_handler(
+        self,
+        context: SlackContext,
+        handler: tuple[HandlerFunction, HandlerOption],
+        callback: Callback | None = None,
+    ) -> str:
         handler_func, option = handler
         queue_name = f"{handler_func.__module__}/{option.get('queue', '__default__')}"
-        await self._modules.queue(queue_name, context, handler_func)
-
+        await self._modules.queue(queue_name, context, handler_func, callback)
         return handler_func.__module__
@@ -0,0 +1,225 @@
+import asyncio
+import gzip
+import json
+import time
+from argparse import ArgumentParser
+from collections import Counter, defaultdict
+from datetime import datetime
+from functools import wraps
+from typing import Any, AsyncIterator, Mapping, Sequence
+
+from oono_akira.config import Configuration
+from oono_akira.db import OonoDatabase
+from oono_akira.modules import Callback, HandlerFunction, HandlerOption
+from oono_akira.oono import OonoAkira
+from oono_akira.slack.any import AnyObject
+from oono_akira.slack.context import SlackContext
+from oono_akira.slack.recv import SlackEventsApiPayload, SlackSlashCommandsPayload
+from oono_akira.slack.send import SlackAPI
+from oono_akira.trace import Trace
+
+Frame = tuple[datetime, str]
+
+
+class ReplaySlackAPI(SlackAPI):
+    RESPONSES: Mapping[str, Any] = {
+        "users.info": {"ok": True, "user": {"profile": {"display_name": "replay"}}},
+    }
+
+    def __init__(self, calls: Counter[str], latency: float = 0, path: tuple[str, ...] = tuple()):
+        self._calls = calls
+        self._latency = latency
+        self._path = path
+
+    def __getattr__(self, key: str):
+        return ReplaySlackAPI(self._calls, self._latency, self._path + (key,))
+
+    async def __call__(self, __data: AnyObject | None = None, **kwargs: Any) -> Any:
+        api = ".".join(self._path)
+        self._calls[api] += 1
+        if self._latency:
+            await asyncio.sleep(self._latency)
+        return self.RESPONSES.get(api, {"ok": True})
+
+
+class ReplayOonoAkira(OonoAkira):
+    """Runs recorded frames through the dispatch pipeline, with Slack stubbed out and no web server."""
+
+    def __init__(self, config: Configuration, api_latency: float = 0):
+        # Compacting would move the payloads being replayed out from under it
+        config = {key: value for key, value in config.items() if key not in ("archive", "snapshot")}  # type: ignore
+        # Without the snapshot and shared store, recorded events aren't seen as handled already,
+        # and the serving instance's state isn't overwritten with the replay's
+        if "dedup" in config:
+            config = {**config, "dedup": {key: value for key, value in config["dedup"].items() if key != "path"}}
+        super().__init__(config)
+        self._api_latency = api_latency
+        self.frames = 0
+        self.events = 0
+        self.commands = 0
+        self.api_calls: Counter[str] = Counter()
+        self.ack_latency: list[float] = []
+        self.module_time: defaultdict[str, list[float]] = defaultdict(list)
+
+    async def _start_server(self):
+        pass
+
+    async def _stop_server(self):
+        pass
+
+    def _record(self, source: str, content: str | Any, frame: Any):
+        pass
+
+    def _api(self, token: str | None = None, trace: Trace | None = None) -> SlackAPI:
+        return ReplaySlackAPI(self.api_calls, self._api_latency)
+
+    async def _process_event(self, envelope_id: str, payload: SlackEventsApiPayload, trace: Trace) -> str:
+        self.events += 1
+        return await super()._process_event(envelope_id, payload, trace)
+
+    async def _process_command(self, envelope_id: str, payload: SlackSlashCommandsPayload, trace: Trace) -> str:
+        self.commands += 1
+        return await super()._process_command(envelope_id, payload, trace)
+
+    async def _queue_handler(
+        self,
+        context: SlackContext,
+        handler: tuple[HandlerFunction, HandlerOption],
+        callback: Callback | None = None,
+    ) -> str:
+        handler_func, option = handler
+
+        @wraps(handler_func)
+        async def timed_handler(context: SlackContext):
+            start = time.perf_counter()
+            try:
+                await handler_func(context)
+            finally:
+                self.module_time[handler_func.__module__].append(time.perf_counter() - start)
+
+        return await super()._queue_handler(context, (timed_handler, option), callback)
+
+    async def _consume_acks(self):
+        while True:
+            _, _, trace = await self._ack_queue.get()
+            self.ack_latency.append(time.perf_counter() - trace.start)
+            self._ack_queue.task_done()
+
+    async def replay(self, frames: AsyncIterator[Frame], paced: bool) -> float:
+        acker = asyncio.create_task(self._consume_acks())
+        first: tuple[datetime, float] | None = None
+        start = time.perf_counter()
+        async for created_at, data in frames:
+            if paced:
+                if first is None:
+                    first = created_at, time.perf_counter()
+                delay = (created_at - first[0]).total_seconds() - (time.perf_counter() - first[1])
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            self.frames += 1
+            await self._process_frame(data)
+        await self._modules.join()
+        await self._ack_queue.join()
+        elapsed = time.perf_counter() - start
+        acker.cancel()
+        return elapsed
+
+
+def percentile(values: Sequence[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+async def database_frames(db: OonoDatabase, limit: int | None) -> AsyncIterator[Frame]:
+    count = 0
+    # Frames of both transports, HTTP envelopes are recorded shaped like Socket Mode frames
+    async for payload in db.iterate_payloads(["websocket", "http"]):
+        if limit is not None and count >= limit:
+            return
+        count += 1
+        yield payload.createdAt, payload.content
+
+
+async def file_frames(path: str, limit: int | None) -> AsyncIterator[Frame]:
+    # Exported files and payload archives alike
+    with gzip.open(path, "rt") if path.endswith(".gz") else open(path) as f:
+        for count, line in enumerate(f):
+            if limit is not None and count >= limit:
+                return
+            item = json.loads(line)
+            yield datetime.fromisoformat(item["created_at"]), item["content"]
+
+
+async def export(config: Configuration, path: str, limit: int | None):
+    count = 0
+    async with OonoDatabase(config["database"]) as db:
+        with open(path, "w") as f:
+            async for created_at, content in database_frames(db, limit):
+                f.write(json.dumps({"created_at": created_at.isoformat(), "content": content}) + "\n")
+                count += 1
+    print(f"Exported {count} frames to {path}")
+
+
+async def replay(config: Configuration, path: str | None, paced: bool, limit: int | None, api_latency: float):
+    async with ReplayOonoAkira(config, api_latency) as oono:
+        frames = file_frames(path, limit) if path else database_frames(oono._db, limit)
+        elapsed = await oono.replay(frames, paced)
+    report: dict[str, Any] = {
+        "frames": oono.frames,
+        "events": oono.events,
+        "commands": oono.commands,
+        "elapsed": elapsed,
+        "events_per_second": (oono.events + oono.commands) / elapsed if elapsed else 0.0,
+        "ack_latency": {f"p{int(p * 100)}": percentile(oono.ack_latency, p) for p in (0.5, 0.9, 0.99, 1.0)},
+        "modules": {
+            module: {"calls": len(times), "total": sum(times), "mean": sum(times) / len(times)}
+            for module, times in sorted(oono.module_time.items())
+        },
+        "api_calls": dict(oono.api_calls),
+    }
+    return report
+
+
+def print_report(report: dict[str, Any]):
+    print(
+        f"Replayed {report['frames']} frames ({report['events']} events, {report['commands']} commands)"
+        f" in {report['elapsed']:.2f} s, {report['events_per_second']:.1f} events/s"
+    )
+    print("Ack latency: " + ", ".join(f"{k} {v * 1000:.2f} ms" for k, v in report["ack_latency"].items()))
+    for module, stats in report["modules"].items():
+        print(
+            f"  {module:<32} {stats['calls']:>6} calls,"
+            f" total {stats['total'] * 1000:9.1f} ms, mean {stats['mean'] * 1000:7.2f} ms"
+        )
+    for api, count in sorted(report["api_calls"].items()):
+        print(f"  {api:<32} {count:>6} calls")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        prog="python -m oono_akira.replay",
+        description="Replay recorded Socket Mode and HTTP frames through the dispatch pipeline with a stubbed Slack API. "
+        "Locks and sessions are written to the configured database, so point it at a copy.",
+    )
+    parser.add_argument("config", help="Path to the configuration file")
+    parser.add_argument("--file", help="Replay frames from an exported file instead of the database")
+    parser.add_argument("--export", metavar="FILE", help="Export recorded frames to a file and exit")
+    parser.add_argument("--paced", action="store_true", help="Keep the original pacing instead of going all out")
+    parser.add_argument("--limit", type=int, help="Stop after this many frames")
+    parser.add_argument("--api-latency", type=float, default=0, help="Seconds every stubbed Slack API call takes")
+    parser.add_argument("--output", metavar="FILE", help="Also write the report to a JSON file")
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        config = json.load(f)
+
+    if args.export:
+        asyncio.run(export(config, args.export, args.limit))
+    else:
+        result = asyncio.run(replay(config, args.file, args.paced, args.limit, args.api_latency))
+        print_report(result)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(result, f, indent=2)
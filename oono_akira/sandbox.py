@@ -0,0 +1,327 @@
+import asyncio
+import itertools
+import multiprocessing
+import os
+import resource
+import shutil
+import signal
+import tempfile
+import traceback
+from contextlib import asynccontextmanager
+from multiprocessing.process import BaseProcess
+from types import ModuleType
+from typing import Any, Awaitable, Callable
+
+from aiohttp import ClientSession
+
+from oono_akira import speedups
+from oono_akira.config import SandboxConfiguration
+from oono_akira.log import log
+from oono_akira.slack.context import SlackContext
+from oono_akira.slack.recv import SlackEventPayload, SlackPayloadParser, SlackSlashCommandsPayload
+from oono_akira.slack.send import SlackPayloadDumper
+from oono_akira.stream import STREAM_LIMIT, read_lines
+
+# Both sides talk in JSON lines. The front sends {"run", "handler", "context"} and answers calls with
+# {"result", "value", "error"}, the worker sends {"call", "run", "target", "name", "args", "kwargs"},
+# {"done", "data", "error"} when a handler finishes and {"retiring"} when it goes over its memory limit.
+
+
+def encode(value: Any) -> Any:
+    # Turns what handlers and the database deal with into plain JSON values
+    if hasattr(value, "__dataclass_fields__"):
+        return SlackPayloadDumper.dump(value)
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json")
+    if isinstance(value, dict):
+        return {key: encode(item) for key, item in value.items()}  # type: ignore
+    if isinstance(value, (list, tuple, set)):
+        return [encode(item) for item in value]  # type: ignore
+    return value
+
+
+class Sandbox:
+    """Runs the handlers of one module in a worker process, serving its Slack API, database and ack calls."""
+
+    CONNECT_TIMEOUT = 30
+    RESTART_DELAY = 1
+
+    def __init__(self, name: str, module: ModuleType, config: SandboxConfiguration):
+        self._name = name
+        self._module = module
+        self._memory_limit = config.get("memory_limit", 0)
+        self._process: BaseProcess | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        self._connected = asyncio.Event()
+        self._stopping = False
+        self._retiring = False
+        self._run_ids = itertools.count()
+        # Context and result of every handler running in the worker
+        self._runs: dict[int, tuple[SlackContext, asyncio.Future[Any]]] = {}
+        self._calls: set[asyncio.Task[None]] = set()
+
+    async def start(self):
+        self._directory = tempfile.mkdtemp(prefix="oono-sandbox-")
+        self._path = os.path.join(self._directory, "front.sock")
+        self._server = await asyncio.start_unix_server(self._accept, self._path, limit=STREAM_LIMIT)
+        self._watcher = asyncio.create_task(self._watch())
+        async with asyncio.timeout(self.CONNECT_TIMEOUT):
+            await self._connected.wait()
+        log(f"Started sandbox for module {self._name}")
+
+    async def stop(self):
+        self._stopping = True
+        # The worker exits once its connection is closed
+        if self._writer is not None:
+            self._writer.close()
+        await self._watcher
+        self._server.close()
+        await self._server.wait_closed()
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+    def can_run(self, handler_func: Callable[[SlackContext], Awaitable[None]]) -> bool:
+        # The worker looks handlers up by name, so closures created by a constructor stay in this process
+        return getattr(self._module, handler_func.__name__, None) is handler_func
+
+    async def run(self, context: SlackContext, handler_func: Callable[[SlackContext], Awaitable[None]]):
+        await self._connected.wait()
+        assert self._writer is not None
+        run_id = next(self._run_ids)
+        future = asyncio.get_running_loop().create_future()
+        self._runs[run_id] = context, future
+        message = {
+            "run": run_id,
+            "handler": handler_func.__name__,
+            "context": {
+                "id": context.id,
+                "workspace": encode(context.workspace),
+                "event": encode(context.event),
+                "command": encode(context.command),
+                "data": encode(context.data),
+            },
+        }
+        self._writer.write(speedups.dumps(message).encode() + b"\n")
+        try:
+            context.data = await future
+        finally:
+            del self._runs[run_id]
+
+    def _spawn(self) -> BaseProcess:
+        # Not a daemon, so that the module can still use a process pool
+        process = multiprocessing.get_context("spawn").Process(
+            target=sandbox_main,
+            args=(self._name, self._path, self._memory_limit, speedups.json_name),
+            name=f"oono-sandbox-{self._name}",
+        )
+        process.start()
+        return process
+
+    async def _watch(self):
+        while not self._stopping:
+            process = self._process = self._spawn()
+            await asyncio.get_running_loop().run_in_executor(None, process.join)
+            self._writer = None
+            self._connected.clear()
+            for _, future in self._runs.values():
+                if not future.done():
+                    future.set_exception(RuntimeError(f"sandbox worker exited with {process.exitcode}"))
+            if self._stopping:
+                break
+            if self._retiring:
+                self._retiring = False
+                log(f"Replacing sandbox worker of module {self._name}")
+            else:
+                log(f"Sandbox worker of module {self._name} exited with {process.exitcode}, restarting", level="error")
+                await asyncio.sleep(self.RESTART_DELAY)
+
+    async def _accept(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        if self._stopping:
+            writer.close()
+            return
+        self._writer = writer
+        self._connected.set()
+        async for line in read_lines(reader):
+            try:
+                message = speedups.loads(line)
+            except ValueError:
+                log(f"Skipping a malformed message from sandbox worker of module {self._name}", level="error")
+                continue
+            if "call" in message:
+                task = asyncio.create_task(self._serve(writer, message))
+                self._calls.add(task)
+                task.add_done_callback(self._calls.discard)
+            elif "done" in message:
+                _, future = self._runs.get(message["done"], (None, None))
+                if future is None or future.done():
+                    continue
+                if message["error"] is not None:
+                    future.set_exception(RuntimeError(f"handler failed in sandbox:\n{message['error']}"))
+                else:
+                    future.set_result(message["data"])
+            elif "retiring" in message:
+                # Runs queued from now on wait for the replacement worker
+                log(f"Sandbox worker of module {self._name} is over its memory limit", level="warning")
+                self._retiring = True
+                self._connected.clear()
+
+    async def _serve(self, writer: asyncio.StreamWriter, message: Any):
+        value, error = None, None
+        try:
+            run = self._runs.get(message["run"])
+            if run is None:
+                # A task the handler left behind, calling after its run finished
+                raise RuntimeError(f"run {message['run']} is already finished")
+            context, _ = run
+            if message["target"] == "ack":
+                await context.ack(*message["args"])
+            elif message["target"] == "api":
+                api = context.api
+                for key in message["name"].split("."):
+                    api = getattr(api, key)
+                value = await api(*message["args"], **message["kwargs"])
+            elif message["target"] == "db" and not message["name"].startswith("_"):
+                value = await getattr(context.db, message["name"])(*message["args"], **message["kwargs"])
+            else:
+                raise RuntimeError(f"unknown call: {message['target']} {message['name']}")
+        except Exception as e:
+            error = repr(e)
+        if not writer.is_closing():
+            writer.write(speedups.dumps({"result": message["call"], "value": encode(value), "error": error}).encode())
+            writer.write(b"\n")
+
+
+class SandboxWorker:
+    """The worker side of a sandbox, running handlers against proxies of the front's API, database and ack."""
+
+    def __init__(self, module: ModuleType, memory_limit: int):
+        self._module = module
+        self._memory_limit = memory_limit
+        self._call_ids = itertools.count()
+        self._calls: dict[int, asyncio.Future[Any]] = {}
+        self._runs: set[asyncio.Task[None]] = set()
+        self._retiring = False
+
+    async def run(self, path: str):
+        reader, self._writer = await asyncio.open_unix_connection(path, limit=STREAM_LIMIT)
+        async for line in read_lines(reader):
+            try:
+                message = speedups.loads(line)
+            except ValueError:
+                log("Skipping a malformed message from the front", level="error")
+                continue
+            if "run" in message:
+                task = asyncio.create_task(self._run(message))
+                self._runs.add(task)
+                task.add_done_callback(self._runs.discard)
+            elif "result" in message:
+                future = self._calls.pop(message["result"])
+                if message["error"] is not None:
+                    future.set_exception(RuntimeError(message["error"]))
+                else:
+                    future.set_result(message["value"])
+        for task in list(self._runs):
+            task.cancel()
+
+    async def call(self, run_id: int, target: str, name: str, *args: Any, **kwargs: Any) -> Any:
+        call_id = next(self._call_ids)
+        future = asyncio.get_running_loop().create_future()
+        self._calls[call_id] = future
+        message = {"call": call_id, "run": run_id, "target": target, "name": name, "args": args, "kwargs": kwargs}
+        self._writer.write(speedups.dumps(encode(message)).encode() + b"\n")
+        return await future
+
+    def _context(self, run_id: int, data: Any) -> SlackContext:
+        from oono_akira.db.prisma.models import Workspace
+
+        async def ack(body: Any = None):
+            await self.call(run_id, "ack", "", body)
+
+        return SlackContext(
+            id=data["id"],
+            api=APIProxy(self, run_id),  # type: ignore
+            db=DatabaseProxy(self, run_id),  # type: ignore
+            ack=ack,
+            workspace=Workspace.model_validate(data["workspace"]),
+            event=SlackPayloadParser._parse(SlackEventPayload, data["event"]) if data["event"] else None,
+            command=SlackPayloadParser._parse(SlackSlashCommandsPayload, data["command"]) if data["command"] else None,
+            data=data["data"],
+        )
+
+    async def _run(self, message: Any):
+        context = self._context(message["run"], message["context"])
+        error = None
+        try:
+            await getattr(self._module, message["handler"])(context)
+        except Exception:
+            error = traceback.format_exc()
+        self._writer.write(
+            speedups.dumps({"done": message["run"], "data": encode(context.data), "error": error}).encode() + b"\n"
+        )
+        # Peak RSS, in kilobytes on Linux
+        if self._memory_limit and resource.getrusage(resource.RUSAGE_SELF).ru_maxrss > self._memory_limit * 1024:
+            self._retire()
+
+    def _retire(self):
+        if self._retiring:
+            return
+        self._retiring = True
+        self._writer.write(speedups.dumps({"retiring": True}).encode() + b"\n")
+        asyncio.create_task(self._exit_when_idle())
+
+    async def _exit_when_idle(self):
+        while self._runs:
+            await asyncio.gather(*self._runs, return_exceptions=True)
+        await self._writer.drain()
+        self._writer.close()
+
+
+class APIProxy:
+    def __init__(self, worker: SandboxWorker, run_id: int, path: tuple[str, ...] = tuple()):
+        self._worker = worker
+        self._run_id = run_id
+        self._path = path
+
+    def __getattr__(self, key: str):
+        return APIProxy(self._worker, self._run_id, self._path + (key,))
+
+    async def __call__(self, __data: Any = None, **kwargs: Any) -> Any:
+        return await self._worker.call(self._run_id, "api", ".".join(self._path), __data, **kwargs)
+
+
+class DatabaseProxy:
+    # Results arrive as plain JSON values, models become dicts and sets become lists
+    def __init__(self, worker: SandboxWorker, run_id: int):
+        self._worker = worker
+        self._run_id = run_id
+
+    def __getattr__(self, key: str):
+        async def call(*args: Any, **kwargs: Any) -> Any:
+            return await self._worker.call(self._run_id, "db", key, *args, **kwargs)
+
+        return call
+
+    @asynccontextmanager
+    async def get_session(self, **kwargs: str):
+        data = await self._worker.call(self._run_id, "db", "load_session", **kwargs)
+        yield data
+        await self._worker.call(self._run_id, "db", "save_session", data, **kwargs)
+
+
+async def run_worker(name: str, path: str, memory_limit: int):
+    # Imported here, the modules package imports this one
+    from oono_akira.modules import ModulesManager
+
+    async with ClientSession(json_serialize=speedups.dumps) as http:
+        async with ModulesManager(http, only=name) as modules:
+            await SandboxWorker(modules.module(name), memory_limit).run(path)
+
+
+def sandbox_main(name: str, path: str, memory_limit: int, json: str):
+    speedups.select_json(json)
+    # Stopped by the front closing the connection, once the handlers it still waits for are done
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    try:
+        asyncio.run(run_worker(name, path, memory_limit))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,268 @@
+import asyncio
+import multiprocessing
+import os
+import shutil
+import signal
+import tempfile
+import time
+import traceback
+import zlib
+from multiprocessing.process import BaseProcess
+from typing import Any
+
+from aiohttp import web
+
+from oono_akira import speedups
+from oono_akira.config import Configuration
+from oono_akira.log import log
+from oono_akira.metrics import DEDUP_HITS, FRAMES
+from oono_akira.oono import OonoAkira
+from oono_akira.stream import STREAM_LIMIT, read_lines
+from oono_akira.trace import Trace
+
+
+def shard_of(team_id: str, workers: int) -> int:
+    # Stable across processes and restarts, unlike hash()
+    return zlib.crc32(team_id.encode()) % workers
+
+
+class ShardFront(OonoAkira):
+    """Owns the Socket Mode connection and acks, and hands envelopes to worker processes by workspace."""
+
+    WORKER_CONNECT_TIMEOUT = 30
+    WORKER_RESTART_DELAY = 1
+    # Workers drain on their own deadline, which starts a bit after the front's
+    WORKER_EXIT_GRACE = 5
+    # Slack redelivers what isn't acked within 3 seconds, an envelope unacked long past that is forgotten
+    PENDING_ACK_TIMEOUT = 30
+    # Bytes written to a worker and not yet read by it, over which envelopes for it are dropped
+    WORKER_BUFFER_LIMIT = 64 * 1024 * 1024
+
+    def __init__(self, config: Configuration, workers: int):
+        super().__init__(config)
+        self._config = config
+        self._workers = workers
+        self._processes: list[BaseProcess | None] = [None] * workers
+        self._writers: list[asyncio.StreamWriter | None] = [None] * workers
+        self._connected = [asyncio.Event() for _ in range(workers)]
+        self._watchers: list[asyncio.Task[None]] = []
+        self._stopping = False
+        # Shard, trace and dedup key of envelopes handed to workers, until the worker acks them
+        self._pending_acks: dict[str, tuple[int, Trace, str]] = {}
+
+    async def __aenter__(self):
+        await super().__aenter__()
+        self._directory = tempfile.mkdtemp(prefix="oono-shard-")
+        self._path = os.path.join(self._directory, "front.sock")
+        self._shard_server = await asyncio.start_unix_server(self._accept, self._path, limit=STREAM_LIMIT)
+        self._watchers = [asyncio.create_task(self._watch(index)) for index in range(self._workers)]
+        try:
+            async with asyncio.timeout(self.WORKER_CONNECT_TIMEOUT):
+                for connected in self._connected:
+                    await connected.wait()
+        except TimeoutError:
+            # No __aexit__ follows, and workers left running would keep this process from exiting
+            self._stopping = True
+            self._kill_workers()
+            raise
+        log(f"Started {self._workers} shard workers")
+        return self
+
+    async def __aexit__(self, *args: Any):
+        self._stopping = True
+        # Workers finish what they have queued and exit when their connection is closed
+        for writer in self._writers:
+            if writer is not None:
+                writer.close()
+        # Workers aren't daemons, one that doesn't exit on its own would keep this process from exiting
+        await asyncio.wait(self._watchers, timeout=self._drain_timeout + self.WORKER_EXIT_GRACE)
+        self._kill_workers()
+        await asyncio.gather(*self._watchers, return_exceptions=True)
+        self._shard_server.close()
+        await self._shard_server.wait_closed()
+        shutil.rmtree(self._directory, ignore_errors=True)
+        await super().__aexit__(*args)
+
+    async def _drain_handlers(self) -> dict[str, int]:
+        report = await super()._drain_handlers()
+        # Workers drain once they read the end of their connection, and their acks still come back over it
+        self._stopping = True
+        for writer in self._writers:
+            if writer is not None:
+                writer.write_eof()
+        _, running = await asyncio.wait(self._watchers, timeout=self._remaining() + self.WORKER_EXIT_GRACE)
+        self._kill_workers()
+        await asyncio.gather(*running, return_exceptions=True)
+        report["workers_killed"] = len(running)
+        return report
+
+    def _kill_workers(self):
+        for index, process in enumerate(self._processes):
+            if process is not None and process.is_alive():
+                log(f"Shard worker {index} is still draining, killing it", level="warning")
+                process.kill()
+
+    def _spawn(self, index: int) -> BaseProcess:
+        # Not a daemon, so that the sandbox and process pools can still start their own processes in it
+        process = multiprocessing.get_context("spawn").Process(
+            target=worker_main, args=(self._config, self._path, index), name=f"oono-shard-{index}"
+        )
+        process.start()
+        return process
+
+    async def _watch(self, index: int):
+        while not self._stopping:
+            process = self._processes[index] = self._spawn(index)
+            await asyncio.get_running_loop().run_in_executor(None, process.join)
+            self._writers[index] = None
+            self._connected[index].clear()
+            for envelope_id in [key for key, (shard, _, _) in self._pending_acks.items() if shard == index]:
+                _, _, key = self._pending_acks.pop(envelope_id)
+                # When stopping, the drain releases and counts them
+                if not self._stopping:
+                    self._dedup.release(key)
+            if not self._stopping:
+                # Unacked envelopes of the shard are redelivered by Slack
+                log(f"Shard worker {index} exited with {process.exitcode}, restarting", level="error")
+                await asyncio.sleep(self.WORKER_RESTART_DELAY)
+
+    async def _accept(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        index = speedups.loads(await reader.readline())["shard"]
+        self._writers[index] = writer
+        self._connected[index].set()
+        log(f"Shard worker {index} connected")
+        async for line in read_lines(reader):
+            try:
+                envelope_id, body = speedups.loads(line)
+            except ValueError:
+                log("Skipping a malformed ack", level="error", shard=index)
+                continue
+            pending = self._pending_acks.pop(envelope_id, None)
+            if pending is None:
+                await self._ack(envelope_id, body, Trace(None, time.perf_counter()))
+                continue
+            _, trace, key = pending
+            self._dedup.finish(key)
+            await self._ack(envelope_id, body, trace)
+
+    async def _process_frame(self, data: str, received: float | None = None, source: str = "websocket") -> bool:
+        # Only peek into the frame, parsing is left to the workers
+        frame = speedups.loads(data)
+        if frame.get("type") not in ("events_api", "slash_commands"):
+            return await super()._process_frame(data, received, source)
+        self._record(source, data, frame)
+        FRAMES.inc(frame["type"])
+        if received is None:
+            received = time.perf_counter()
+        envelope_id = frame["envelope_id"]
+        payload = frame["payload"]
+        key = payload["event_id"] if frame["type"] == "events_api" else f"command/{envelope_id}"
+        track = await self._dedup.claim(key)
+        if track is not None:
+            DEDUP_HITS.inc()
+            log("Duplicate envelope", category="event", key=key, handler=track, envelope=envelope_id)
+            await self._ack(envelope_id, None, self._new_trace(received))
+            return True
+        self._expire_pending(received)
+        index = shard_of(payload["team_id"], self._workers)
+        writer = self._writers[index]
+        if writer is None:
+            self._drop(envelope_id, key, "Shard worker is down, dropping envelope", index)
+            return True
+        # There's no drain, a slow shard must not hold up the others. A stalled one gets its envelopes dropped
+        # instead, and Slack redelivers them.
+        if writer.transport.get_write_buffer_size() > self.WORKER_BUFFER_LIMIT:
+            self._drop(envelope_id, key, "Shard worker is not keeping up, dropping envelope", index)
+            return True
+        self._dedup.update(key, f"shard/{index}")
+        self._pending_acks[envelope_id] = index, self._new_trace(received), key
+        # Frames go as JSON strings, so a frame can never span lines
+        writer.write(speedups.dumps(data).encode() + b"\n")
+        return True
+
+    def _drop(self, envelope_id: str, key: str, message: str, index: int):
+        self._dedup.release(key)
+        log(message, level="warning", shard=index, envelope=envelope_id)
+        # Over HTTP nothing is redelivered unless the request fails
+        future = self._http_acks.get(envelope_id)
+        if future is not None and not future.done():
+            future.set_exception(web.HTTPServiceUnavailable())
+
+    def _expire_pending(self, now: float):
+        # Envelopes are added in the order they're received, so the oldest are first
+        while self._pending_acks:
+            envelope_id = next(iter(self._pending_acks))
+            index, trace, _ = self._pending_acks[envelope_id]
+            if now - trace.start < self.PENDING_ACK_TIMEOUT:
+                break
+            # Its dedup claim is left to expire, the worker may still be running it
+            del self._pending_acks[envelope_id]
+            log("Shard worker never acked envelope, forgetting it", level="warning", shard=index, envelope=envelope_id)
+
+
+class ShardWorker(OonoAkira):
+    """Runs the dispatch pipeline for the workspaces of one shard, fed by the front process."""
+
+    def __init__(self, config: Configuration, path: str, index: int):
+        super().__init__(config)
+        self._path = path
+        self._index = index
+
+    async def _start_server(self):
+        pass
+
+    async def _stop_server(self):
+        pass
+
+    def _record(self, source: str, content: str | Any, frame: Any):
+        # Frames are recorded by the front
+        pass
+
+    async def run(self):
+        reader, writer = await asyncio.open_unix_connection(self._path, limit=STREAM_LIMIT)
+        writer.write(speedups.dumps({"shard": self._index}).encode() + b"\n")
+        acks = asyncio.create_task(self._forward_acks(writer))
+        # Frames are processed one by one, so envelopes of a channel keep their order
+        async for line in read_lines(reader):
+            try:
+                await self._process_frame(speedups.loads(line))
+            except Exception:
+                log("Failed to process frame", level="error", traceback=traceback.format_exc())
+        # The front closes the connection when it stops
+        self.stop()
+        await self._drain()
+        acks.cancel()
+        writer.close()
+
+    async def _forward_acks(self, writer: asyncio.StreamWriter):
+        while True:
+            envelope_id, body, _ = await self._ack_queue.get()
+            writer.write(speedups.dumps([envelope_id, body]).encode() + b"\n")
+            await writer.drain()
+            self._ack_queue.task_done()
+
+
+async def run_worker(config: Configuration, path: str, index: int):
+    async with ShardWorker(config, path, index) as worker:
+        await worker.run()
+
+
+def worker_main(config: Configuration, path: str, index: int):
+    runtime = config.get("runtime", {})
+    speedups.select_loop(runtime.get("loop", "auto"))
+    speedups.select_json(runtime.get("json", "auto"))
+    # Envelopes are deduplicated by the front, a shared store would see every one as a duplicate here.
+    # The archive is compacted by the front alone, workers would only compete with it for the same rows.
+    config = {key: value for key, value in config.items() if key not in ("dedup", "archive")}  # type: ignore
+    # Every worker writes its own trace file and snapshot
+    if "tracing" in config:
+        config = {**config, "tracing": {**config["tracing"], "path": f"{config['tracing']['path']}.{index}"}}
+    if "snapshot" in config:
+        config = {**config, "snapshot": {**config["snapshot"], "path": f"{config['snapshot']['path']}.{index}"}}
+    # Stopped by the front closing the connection, not by signals sent to the whole process group
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    try:
+        asyncio.run(run_worker(config, path, index))
+    except KeyboardInterrupt:
+        pass
@@ -2,7 +2,7 @@ from typing import Optional, Sequence, Self
 from dataclasses import dataclass, field
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class RichTextStyle:
     bold: Optional[bool] = None
     italic: Optional[bool] = None
@@ -10,7 +10,7 @@ class RichTextStyle:
     code: Optional[bool] = None
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class RichTextSpan:
     type: str
     text: Optional[str] = None
@@ -20,7 +20,7 @@ class RichTextSpan:
     skin_tone: Optional[int] = None
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class RichTextElement:
     type: str
     elements: "Sequence[RichTextSpan | RichTextElement]" = field(
@@ -36,7 +36,7 @@ class RichTextElement:
     border: Optional[int] = None
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Block:
     type: str
     elements: Optional[Sequence[RichTextElement]] = field(
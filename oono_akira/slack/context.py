@@ -1,18 +1,19 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Any, Awaitable, Protocol
 
 from oono_akira.db import OonoDatabase
 from oono_akira.db.prisma.models import Workspace
 from oono_akira.slack.send import SlackAPI
 from oono_akira.slack.recv import SlackEventPayload, SlackSlashCommandsPayload
+from oono_akira.trace import Trace
 
 
 class SlackAckFunction(Protocol):
-    def __call__(self, body: Any = ..., /) -> Awaitable[None]:
-        ...
+    def __call__(self, body: Any = ..., /) -> Awaitable[None]: ...
 
 
-@dataclass
+# Not frozen, handlers keep their state in data
+@dataclass(slots=True)
 class SlackContext:
     id: str
     api: SlackAPI
@@ -22,6 +23,7 @@ class SlackContext:
     event: SlackEventPayload | None = None
     command: SlackSlashCommandsPayload | None = None
     data: Any = None
+    trace: Trace = field(default_factory=lambda: Trace(None, 0.0))
 
     def must_event(self):
         if self.event is None:
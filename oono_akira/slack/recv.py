@@ -1,12 +1,12 @@
 import sys
 from dataclasses import dataclass, field, fields
-from typing import Sequence, Optional, Type, TypeVar
+from typing import Any, Sequence, Optional, Type, TypeVar
 
 from oono_akira.slack.any import AnyObject
 from oono_akira.slack.block import Block
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class SlackEventPayload:
     type: str
     user: str
@@ -18,7 +18,7 @@ class SlackEventPayload:
     blocks: Optional[Sequence[Block]] = None
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class SlackEventsApiPayload:
     type: str
     team_id: str
@@ -26,7 +26,7 @@ class SlackEventsApiPayload:
     event: SlackEventPayload
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class SlackSlashCommandsPayload:
     team_id: str
     channel_id: str
@@ -36,7 +36,7 @@ class SlackSlashCommandsPayload:
     response_url: str
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class SlackWebSocketEventPayload:
     type: str
     envelope_id: Optional[str] = None
@@ -55,45 +55,59 @@ class SlackWebSocketEventPayload:
 
 class SlackPayloadParser:
     T = TypeVar("T")
+    # Per model, every field's name, its candidate types by the value of another field, its type unwrapped from
+    # Optional and Sequence, and whether it's a sequence. Worked out once, as annotations can be strings to evaluate.
+    _plans: dict[type, list[tuple[str, list[tuple[tuple[str, Any], type]], Any, bool]]] = {}
 
     @staticmethod
-    def _parse(t: Type[T], d: AnyObject) -> T:
-        kwargs = {}
+    def _plan(t: type) -> list[tuple[str, list[tuple[tuple[str, Any], type]], Any, bool]]:
+        plan = SlackPayloadParser._plans.get(t)
+        if plan is not None:
+            return plan
+        plan = []
         for field in fields(t):  # type: ignore
-            if field.name not in d:
+            candidates = [
+                (condition, t if getattr(candidate_type, "_name", None) == "Self" else candidate_type)
+                for condition, candidate_type in field.metadata.items()
+            ]
+            unwrapped_type = field.type
+            if isinstance(unwrapped_type, str):
+                unwrapped_type = eval(unwrapped_type, vars(sys.modules[t.__module__]))
+            if getattr(unwrapped_type, "_name", None) == "Optional":
+                unwrapped_type = unwrapped_type.__args__[0]
+            sequence = getattr(unwrapped_type, "_name", None) == "Sequence"
+            if sequence:
+                unwrapped_type = unwrapped_type.__args__[0]
+            plan.append((field.name, candidates, unwrapped_type, sequence))
+        SlackPayloadParser._plans[t] = plan
+        return plan
+
+    @staticmethod
+    def _parse(t: Type[T], d: AnyObject) -> T:
+        kwargs: dict[str, Any] = {}
+        for name, candidates, unwrapped_type, sequence in SlackPayloadParser._plan(t):
+            if name not in d:
                 continue
-            pending = None
             inferred_type = None
-            if field.metadata:
-                for (key, value), candidate_type in field.metadata.items():
+            if candidates:
+                for (key, value), candidate_type in candidates:
                     if key in kwargs and kwargs[key] == value:
                         inferred_type = candidate_type
                         break
                 else:
                     continue
-            if getattr(inferred_type, "_name", None) == "Self":
-                inferred_type = t
-            unwrapped_type = field.type
-            if isinstance(unwrapped_type, str):
-                unwrapped_type = eval(unwrapped_type, vars(sys.modules[t.__module__]))
-            if getattr(unwrapped_type, "_name", None) == "Optional":
-                unwrapped_type = unwrapped_type.__args__[0]
-            if getattr(unwrapped_type, "_name", None) == "Sequence":
-                pending = []
-                unwrapped_type = unwrapped_type.__args__[0]
             dst_type = inferred_type or unwrapped_type
-            src_value = d[field.name]
+            src_value = d[name]
             if hasattr(dst_type, "__dataclass_fields__"):
-                if isinstance(pending, list):
+                if sequence:
                     assert isinstance(src_value, list)
-                    for item in src_value:
-                        pending.append(SlackPayloadParser._parse(dst_type, item))  # type: ignore
+                    # Tuples, as the models are frozen, and a tuple takes less than a list of the same items
+                    kwargs[name] = tuple(SlackPayloadParser._parse(dst_type, item) for item in src_value)
                 else:
                     assert isinstance(src_value, dict)
-                    pending = SlackPayloadParser._parse(dst_type, src_value)
+                    kwargs[name] = SlackPayloadParser._parse(dst_type, src_value)
             else:
-                pending = d[field.name]
-            kwargs[field.name] = pending
+                kwargs[name] = src_value
         return t(**kwargs)
 
     @staticmethod
@@ -1,10 +1,14 @@
+import time
 from dataclasses import fields
 from typing import Any, Mapping
 
 from aiohttp import ClientSession
 
+from oono_akira import speedups
 from oono_akira.log import log
+from oono_akira.metrics import API_ERRORS, API_LATENCY
 from oono_akira.slack.any import AnyObject, AnyValue
+from oono_akira.trace import Trace
 
 
 class SlackAPI:
@@ -18,13 +22,17 @@ class SlackAPI:
         session: ClientSession,
         token: str | None = None,
         path: tuple[str, ...] = tuple(),
+        url: str = "https://slack.com/api",
+        trace: Trace | None = None,
     ):
         self._session = session
         self._token = token
         self._path = path
+        self._url = url
+        self._trace = trace
 
     def __getattr__(self, key: str):
-        return SlackAPI(self._session, self._token, self._path + (key,))
+        return SlackAPI(self._session, self._token, self._path + (key,), self._url, self._trace)
 
     async def __call__(self, __data: AnyObject | None = None, **kwargs: Any) -> Any:
         # Prepare request payload
@@ -45,10 +53,29 @@ class SlackAPI:
         if self._token:
             headers["Authorization"] = f"Bearer {self._token}"
         # Send request
-        resp = await self._session.request(method, f"https://slack.com/api/{api}", headers=headers, **body)
-        result = await resp.json()
+        start = time.perf_counter()
+        try:
+            resp = await self._session.request(method, f"{self._url}/{api}", headers=headers, **body)
+            result = await resp.json(loads=speedups.loads)
+        except Exception as e:
+            API_ERRORS.inc(api, type(e).__name__)
+            if self._trace is not None:
+                self._trace.add(api, start, time.perf_counter(), error=type(e).__name__)
+            raise
+        finally:
+            API_LATENCY.observe(time.perf_counter() - start, api)
+        if self._trace is not None:
+            self._trace.add(api, start, time.perf_counter(), status=resp.status, error=result.get("error"))
         if not result.get("ok"):
-            log(f"Error: {result}")
+            API_ERRORS.inc(api, result.get("error", "unknown"))
+            log(
+                "Slack API error",
+                level="warning",
+                category="api",
+                method=api,
+                error=result.get("error"),
+                response=result,
+            )
         return result
 
 
@@ -63,7 +90,7 @@ class SlackPayloadDumper:
             if value is None:
                 continue
             pending: AnyValue | None = None
-            if isinstance(value, list):
+            if isinstance(value, (list, tuple)):
                 pending = []
                 for item in value:  # type: ignore
                     pending.append(SlackPayloadDumper.dump(item))
@@ -0,0 +1,19 @@
+import hashlib
+import hmac
+import time
+
+# Slack's recommendation, older requests may be replays
+MAX_REQUEST_AGE = 300
+
+
+def verify_request(signing_secret: str, timestamp: str | None, signature: str | None, body: bytes) -> bool:
+    if timestamp is None or signature is None:
+        return False
+    try:
+        if abs(time.time() - int(timestamp)) > MAX_REQUEST_AGE:
+            return False
+    except ValueError:
+        return False
+    base = b"v0:" + timestamp.encode() + b":" + body
+    expected = "v0=" + hmac.new(signing_secret.encode(), base, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
@@ -0,0 +1,60 @@
+import hashlib
+import os
+import pickle
+import struct
+import tempfile
+import time
+from typing import Any
+
+from oono_akira.log import log
+
+MAGIC = b"OONOSNAP"
+# Bump when the layout of the state changes, older snapshots are then ignored
+VERSION = 1
+# Magic, version, creation time and SHA-256 of the pickled state
+HEADER = struct.Struct("!8sHd32s")
+
+
+def save_snapshot(path: str, state: Any):
+    data = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+    header = HEADER.pack(MAGIC, VERSION, time.time(), hashlib.sha256(data).digest())
+    # Written next to the target and renamed over it, so a crash never leaves a half written snapshot
+    fd, temp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=".snapshot-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(header)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, path)
+    except BaseException:
+        os.unlink(temp)
+        raise
+    return len(header) + len(data)
+
+
+def load_snapshot(path: str, max_age: float) -> Any | None:
+    try:
+        with open(path, "rb") as f:
+            header = f.read(HEADER.size)
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    if len(header) < HEADER.size:
+        log(f"Ignoring snapshot {path}: truncated", level="warning")
+        return None
+    magic, version, created, digest = HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION:
+        log(f"Ignoring snapshot {path}: unknown format", level="warning")
+        return None
+    if time.time() - created > max_age:
+        log(f"Ignoring snapshot {path}: written {time.time() - created:.0f} seconds ago")
+        return None
+    if hashlib.sha256(data).digest() != digest:
+        log(f"Ignoring snapshot {path}: checksum mismatch", level="warning")
+        return None
+    try:
+        return pickle.loads(data)
+    except Exception as e:
+        log(f"Ignoring snapshot {path}: {e!r}", level="warning")
+        return None
@@ -0,0 +1,56 @@
+import asyncio
+import json
+from typing import Any, Callable
+
+from oono_akira.log import log
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+
+def _orjson_dumps(obj: Any) -> str:
+    assert orjson is not None
+    return orjson.dumps(obj).decode()
+
+
+CODECS: dict[str, tuple[Callable[[str | bytes], Any], Callable[[Any], str]]] = {"json": (json.loads, json.dumps)}
+if orjson is not None:
+    CODECS["orjson"] = (orjson.loads, _orjson_dumps)
+
+# Call sites go through the module, e.g. speedups.loads(data), so they pick up what was selected at startup
+json_name = "json"
+loads, dumps = CODECS[json_name]
+
+
+def select_json(choice: str = "auto") -> str:
+    global json_name, loads, dumps
+    if choice == "auto":
+        choice = "orjson" if "orjson" in CODECS else "json"
+    elif choice not in CODECS:
+        log(f"JSON codec {choice} is not available, falling back to json", level="warning")
+        choice = "json"
+    json_name = choice
+    loads, dumps = CODECS[choice]
+    return choice
+
+
+def select_loop(choice: str = "auto") -> str:
+    # Must be called before the loop is created
+    if choice == "auto":
+        choice = "uvloop" if uvloop is not None else "asyncio"
+    elif choice == "uvloop" and uvloop is None:
+        log("Event loop uvloop is not available, falling back to asyncio", level="warning")
+        choice = "asyncio"
+    if choice == "uvloop":
+        assert uvloop is not None
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    else:
+        asyncio.set_event_loop_policy(None)
+    return choice
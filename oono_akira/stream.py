@@ -0,0 +1,20 @@
+import asyncio
+from typing import AsyncIterator
+
+from oono_akira.log import log
+
+# Messages between processes go on one line each, and a 40k character message is several times that once escaped
+STREAM_LIMIT = 16 * 1024 * 1024
+
+
+async def read_lines(reader: asyncio.StreamReader) -> AsyncIterator[bytes]:
+    # A line over the limit is skipped, rather than ending the connection with everything else on it
+    while True:
+        try:
+            line = await reader.readline()
+        except ValueError:
+            log("Skipping a line over the stream limit", level="error")
+            continue
+        if not line:
+            return
+        yield line
@@ -0,0 +1,135 @@
+import itertools
+import json
+import os
+import queue
+import random
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from typing import Any, Iterator, TextIO
+
+from oono_akira.config import TracingConfiguration
+from oono_akira.log import log
+
+Span = tuple[str, float, float, dict[str, Any]]
+
+
+class Trace:
+    """Timed spans of one envelope, from the moment it was received."""
+
+    # One is alive for every envelope in flight
+    __slots__ = ("tracer", "start", "sampled", "name", "thread", "_spans")
+
+    def __init__(self, tracer: "Tracer | None", start: float, sampled: bool = False):
+        self.tracer = tracer
+        self.start = start
+        self.sampled = sampled
+        self.name = ""
+        # Row of the trace in the viewer, assigned when it's first written
+        self.thread = 0
+        self._spans: list[Span] = []
+
+    def add(self, name: str, start: float, end: float, **args: Any):
+        if self.tracer is not None:
+            self._spans.append((name, start, end, args))
+
+    @contextmanager
+    def span(self, name: str, **args: Any) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.perf_counter(), **args)
+
+    def finish(self):
+        # Called when dispatch returns and again when the handler is done, spans are kept in memory until then
+        if self.tracer is None:
+            return
+        if not self.sampled and time.perf_counter() - self.start >= self.tracer.slow_threshold:
+            self.sampled = True
+        if self.sampled and self._spans:
+            self.tracer.export(self, self._spans)
+            self._spans = []
+
+
+class Tracer:
+    """Writes sampled traces to a file in the Chrome trace event format, viewable in Perfetto."""
+
+    # Events are serialized and written by a background thread, like log records
+    QUEUE_SIZE = 10000
+
+    def __init__(self, config: TracingConfiguration):
+        self.path = config["path"]
+        self.sample_rate = config.get("sample_rate", 0.01)
+        # Traces slower than this are always written, whatever the sample rate
+        self.slow_threshold = config.get("slow_threshold", 1.0)
+        self._file: TextIO | None = None
+        self._threads = itertools.count(1)
+        # Spans are timed with perf_counter, shift them to wall clock time
+        self._offset = time.time() - time.perf_counter()
+        self._queue: queue.Queue[list[dict[str, Any]] | None] = queue.Queue(self.QUEUE_SIZE)
+        self._writer: threading.Thread | None = None
+        self._dropped = 0
+
+    def trace(self, start: float) -> Trace:
+        return Trace(self, start, random.random() < self.sample_rate)
+
+    def export(self, trace: Trace, spans: list[Span]):
+        events: list[dict[str, Any]] = []
+        if not trace.thread:
+            trace.thread = next(self._threads)
+            events.append(
+                {"ph": "M", "name": "thread_name", "pid": 1, "tid": trace.thread, "args": {"name": trace.name}}
+            )
+        for name, start, end, args in spans:
+            event = {
+                "ph": "X",
+                "name": name,
+                "pid": 1,
+                "tid": trace.thread,
+                "ts": round((start + self._offset) * 1e6),
+                "dur": round((end - start) * 1e6),
+            }
+            args = {key: value for key, value in args.items() if value is not None}
+            if args:
+                event["args"] = args
+            events.append(event)
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._write, name="oono-trace", daemon=True)
+            self._writer.start()
+        try:
+            self._queue.put_nowait(events)
+        except queue.Full:
+            # Dropping is better than stalling the loop, the count is logged once the writer catches up
+            self._dropped += 1
+
+    def _write(self):
+        while True:
+            events = self._queue.get()
+            if events is None:
+                break
+            if self._dropped:
+                dropped, self._dropped = self._dropped, 0
+                log(f"Dropped {dropped} traces", level="warning")
+            try:
+                if self._file is None:
+                    # The array format allows leaving out the closing bracket, so traces are appended as they come
+                    is_new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+                    self._file = open(self.path, "a")
+                    if is_new:
+                        self._file.write("[\n")
+                    log(f"Writing traces to {self.path}")
+                self._file.write("".join(json.dumps(event, ensure_ascii=False) + ",\n" for event in events))
+            except Exception:
+                log("Failed to write traces", level="error", traceback=traceback.format_exc())
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        # Waits for the traces exported so far to be written
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None